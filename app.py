@@ -1,150 +1,57 @@
 import streamlit as st
-from core import get_template_frames, get_template_image, create_image_with_text, get_illustration_frames, get_illustration_image
-import random
-from io import BytesIO
+from core import get_template_frames, get_illustration_frames, iter_render_pipeline, parse_multiple_headlines, encode_image, output_filename, OUTPUT_FORMATS, ASSET_WARMUP, start_asset_warmup, asset_warmup_status, pick_asset, render_cache_key, get_cached_render, store_cached_render, DETERMINISTIC_RENDER, RENDER_SEED
+import uuid
 import zipfile
-import base64
+import tempfile
 import os
-import requests
-from PIL import Image
+import logging
 from dotenv import load_dotenv
+from result_store import result_store, match_previous_results
+import metrics
 
 # .envファイルを読み込み
 load_dotenv()
 
-def parse_multiple_headlines(text):
-    """見出しを解析し、レベルと内容を抽出"""
-    headlines = []
-    lines = text.split('\n')
-
-    for line in lines:
-        line = line.strip()
-        if line.startswith('###'):  # 見出し3は除外
-            continue
-        elif line.startswith('##'):  # 見出し2（挿入画像）
-            headline_text = line[2:].strip()
-            if headline_text:
-                headlines.append({
-                    'text': headline_text,
-                    'level': 2,
-                    'type': '挿入画像'
-                })
-        elif line.startswith('#'):  # 見出し1（アイキャッチ画像）
-            headline_text = line[1:].strip()
-            if headline_text:
-                headlines.append({
-                    'text': headline_text,
-                    'level': 1,
-                    'type': 'アイキャッチ画像'
-                })
-
-    # 見出しが見つからない場合は全体をアイキャッチとして扱う
-    if not headlines and text.strip():
-        headlines.append({
-            'text': text.strip(),
-            'level': 1,
-            'type': 'アイキャッチ画像'
-        })
-
-    return headlines
-
-
+# ログレベル（DEBUGにすると描画ごとのレイアウト情報も出力）
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
 
-def get_high_resolution_template_image(frame_id):
-    """高解像度テンプレート画像を取得（scale=2）"""
-    FIGMA_TOKEN = os.getenv('FIGMA_TOKEN')
-    FIGMA_FILEKEY = os.getenv('FIGMA_FILEKEY')
+def image_to_bytes(image, output_format="png", **encoder_options):
+    """PIL Imageを指定形式（既定はPNG）のバイトデータとして出力"""
+    return encode_image(image, output_format, **encoder_options)
 
-    if not FIGMA_TOKEN or not FIGMA_FILEKEY:
-        return None
-
-    headers = {"X-Figma-Token": FIGMA_TOKEN}
-    url = f"https://api.figma.com/v1/images/{FIGMA_FILEKEY}?ids={frame_id}&format=png&scale=2"  # 高解像度
+def create_zip_download(encoded_with_names):
+    """エンコード済み画像をZIPファイルにまとめ、読み込み用に開いたファイルを返す
 
+    アーカイブ全体をメモリに載せないよう一時ファイルへ書き出す。
+    画像はどの出力形式でも圧縮済みのため、再圧縮せず無圧縮（STORED）で格納する。
+    """
+    fd, zip_path = tempfile.mkstemp(prefix="generated_images_", suffix=".zip")
     try:
-        # Figma APIから画像URLを取得
-        res = requests.get(url, headers=headers)
-        if res.status_code != 200:
-            return None
-
-        data = res.json()
-        image_url = data.get("images", {}).get(frame_id)
-        if not image_url:
-            return None
-
-        # 画像データをダウンロード
-        img_response = requests.get(image_url)
-        if img_response.status_code != 200:
-            return None
-
-        # PIL Imageとして返す
-        return Image.open(BytesIO(img_response.content))
-
-    except Exception as e:
-        print(f"高解像度画像取得エラー: {e}")
-        return None
-
-def get_high_resolution_illustration_image(frame_id):
-    """高解像度イラスト画像を取得（scale=2）"""
-    FIGMA_TOKEN = os.getenv('FIGMA_TOKEN')
-    FIGMA_FILEKEY = os.getenv('FIGMA_FILEKEY')
-
-    if not FIGMA_TOKEN or not FIGMA_FILEKEY:
-        return None
-
-    headers = {"X-Figma-Token": FIGMA_TOKEN}
-    url = f"https://api.figma.com/v1/images/{FIGMA_FILEKEY}?ids={frame_id}&format=png&scale=2"  # 高解像度
+        with os.fdopen(fd, 'wb') as zip_output:
+            with zipfile.ZipFile(zip_output, 'w', zipfile.ZIP_STORED) as zip_file:
+                for img_bytes, filename in encoded_with_names:
+                    zip_file.writestr(filename, img_bytes)
+
+        return open(zip_path, 'rb')
+    finally:
+        # 開いたファイルは削除後も読める（削除できない環境では一時フォルダに残る）
+        try:
+            os.remove(zip_path)
+        except OSError:
+            pass
 
+def main():
+    # METRICS_PORT が設定されていれば /metrics を公開（プロセスで1度だけ起動）
     try:
-        # Figma APIから画像URLを取得
-        res = requests.get(url, headers=headers)
-        if res.status_code != 200:
-            return None
-
-        data = res.json()
-        image_url = data.get("images", {}).get(frame_id)
-        if not image_url:
-            return None
-
-        # 画像データをダウンロード
-        img_response = requests.get(image_url)
-        if img_response.status_code != 200:
-            return None
-
-        # PIL Imageとして返す
-        return Image.open(BytesIO(img_response.content))
-
-    except Exception as e:
-        print(f"高解像度イラスト画像取得エラー: {e}")
-        return None
-
-def image_to_bytes(image):
-    """PIL ImageをバイトデータとしてPNG形式で出力"""
-    img_buffer = BytesIO()
-    image.save(img_buffer, format='PNG')
-    return img_buffer.getvalue()
-
-def create_download_link(image, filename):
-    """画像のダウンロードリンクを作成"""
-    img_bytes = image_to_bytes(image)
-    b64 = base64.b64encode(img_bytes).decode()
-    href = f'<a href="data:image/png;base64,{b64}" download="{filename}" style="text-decoration: none; background-color: #4CAF50; color: white; padding: 8px 16px; border-radius: 4px; display: inline-block;">💾 {filename}をダウンロード</a>'
-    return href
-
-def create_zip_download(images_with_names):
-    """複数画像をZIPファイルとしてダウンロード"""
-    zip_buffer = BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        for image, filename in images_with_names:
-            img_bytes = image_to_bytes(image)
-            zip_file.writestr(filename, img_bytes)
-
-    zip_bytes = zip_buffer.getvalue()
-    b64 = base64.b64encode(zip_bytes).decode()
-    href = f'<a href="data:application/zip;base64,{b64}" download="generated_images.zip" style="text-decoration: none; background-color: #FF6B6B; color: white; padding: 8px 16px; border-radius: 4px; display: inline-block;">📦 一括ダウンロード (ZIP)</a>'
-    return href
+        metrics.start_metrics_server()
+    except OSError as e:
+        logger.warning("メトリクスサーバーを起動できません: %s", e)
+
+    # ASSET_WARMUP=1 なら全素材をバックグラウンドで先読み（プロセスで1度だけ）
+    if ASSET_WARMUP:
+        start_asset_warmup()
 
-def main():
     st.set_page_config(page_title="📝 Template Image Creator", page_icon="🎨", layout="wide")
 
     st.title("📝 Template Image Creator")
@@ -162,14 +69,76 @@ def main():
             help="アイキャッチ画像（#）のレイアウト\n※挿入画像（##）は自動で中央揃え"
         )
 
-        st.info("🎨 **高解像度**: 常時ON")
-        st.info("🎲 **画像素材**: 全てランダム選択")
+        # 出力形式
+        output_format = st.selectbox(
+            "💾 出力形式:",
+            list(OUTPUT_FORMATS.keys()),
+            format_func=lambda x: OUTPUT_FORMATS[x]['label'],
+            help="PNG（減色）はフラットな配色のテンプレートで容量を大きく削減できます"
+        )
+        encoder_options = {}
+        if output_format in ("png", "png8"):
+            encoder_options['compress_level'] = st.slider("🗜️ PNG圧縮レベル", 0, 9, 6, help="大きいほど小さく・遅くなります")
+        elif output_format in ("webp", "jpeg"):
+            encoder_options['quality'] = st.slider("🎚️ 画質", 50, 100, 90)
+
+        # プレビューモード（scale=1で素早く確認し、高解像度はダウンロード時に生成）
+        preview_mode = st.toggle("⚡ プレビューモード", value=True, help="低解像度で素早く改行などを確認し、高解像度の画像はダウンロード時に生成します")
+        if preview_mode:
+            st.info("🎨 **高解像度**: ダウンロード時に生成")
+        else:
+            st.info("🎨 **高解像度**: 常時ON")
+        # 固定モード（同じ見出しには同じ素材を選び、生成済みの画像を再利用）
+        deterministic = st.toggle("🎯 素材を固定", value=DETERMINISTIC_RENDER, help="同じ見出しには常に同じ背景・イラストを使い、内容が変わらなければ生成済みの画像を再利用します")
+        render_seed = None
+        if deterministic:
+            render_seed = int(st.number_input("🌱 シード値", value=RENDER_SEED, step=1, help="変えると別の素材の組み合わせになります"))
+            st.info("🎯 **画像素材**: 見出しごとに固定")
+        else:
+            st.info("🎲 **画像素材**: 全てランダム選択")
+
+        # 変更した見出しだけ作り直す（オフにすると毎回全て作り直す）
+        incremental = st.toggle("♻️ 変更した見出しだけ再生成", value=True, help="前回と同じ見出しは画像と素材をそのまま使い、追加・変更した見出しだけを生成します")
+
+        # 生成結果のメモリ使用量（全セッション合計）
+        usage = result_store.usage()
+        st.caption(f"🧠 結果メモリ: {usage['bytes'] / 1024 / 1024:.1f}MB / {usage['global_budget'] / 1024 / 1024:.0f}MB（{usage['sessions']}セッション・{usage['results']}枚）")
+
+        # 素材の先読み状況
+        if ASSET_WARMUP:
+            warmup = asset_warmup_status()
+            if warmup['state'] == 'running':
+                progress = warmup['completed'] / warmup['total'] if warmup['total'] else 0.0
+                st.progress(progress, text=f"📥 素材を準備中... {warmup['completed']}/{warmup['total']}")
+            elif warmup['state'] == 'ready':
+                st.caption(f"✅ 素材の準備完了（{warmup['total'] - warmup['failed']}/{warmup['total']}件, {warmup['elapsed_seconds']:.1f}秒）")
+            elif warmup['state'] == 'failed':
+                st.caption("⚠️ 素材の先読みに失敗しました（生成時に取得します）")
+
+        # 処理段階ごとの所要時間（プロセス全体の集計）
+        with st.expander("📈 処理時間"):
+            snapshot = metrics.snapshot()
+            if snapshot['stages']:
+                st.table([
+                    {
+                        '段階': stage,
+                        '回数': values['count'],
+                        '平均(ms)': round(values['mean_seconds'] * 1000, 2),
+                        'p95(ms)': values['p95_seconds'] * 1000
+                    }
+                    for stage, values in sorted(snapshot['stages'].items())
+                ])
+            else:
+                st.caption("まだ計測結果がありません")
+            st.download_button("📄 Prometheus形式で保存", data=metrics.render_prometheus(), file_name="metrics.txt", mime="text/plain", on_click="ignore")
 
     # 初期化（バックグラウンドで実行）
-    if 'template_frames' not in st.session_state:
-        st.session_state.template_frames = get_template_frames()
-    if 'illustration_frames' not in st.session_state:
-        st.session_state.illustration_frames = get_illustration_frames()
+    if 'result_session_id' not in st.session_state:
+        st.session_state.result_session_id = uuid.uuid4().hex
+    session_id = st.session_state.result_session_id
+    # 素材一覧はプロセス内で共有（有効期間を過ぎたらバックグラウンドで取り直す）
+    template_frames = get_template_frames()
+    illustration_frames = get_illustration_frames()
 
     # 全てランダム選択に固定
     template_selected, template_random = None, True
@@ -210,10 +179,7 @@ def main():
             st.error("❌ 見出しテキストを入力してください。")
         else:
             # 画像生成処理
-            if 'generated_results' not in st.session_state:
-                st.session_state.generated_results = []
-
-            st.session_state.generated_results = []  # リセット
+            generated_results = []  # リセット
 
             # 不要なセッション状態をクリア
             for key in list(st.session_state.keys()):
@@ -225,120 +191,220 @@ def main():
             progress_bar = st.progress(0)
             status_text = st.empty()
 
-            for i, headline_data in enumerate(headlines, 1):
-                headline_text = headline_data['text']
-                headline_type = headline_data['type']
-
-                # 進捗表示
-                progress = i / total_images
-                progress_bar.progress(progress)
-                type_icon = "🖼️" if headline_type == "アイキャッチ画像" else "📝"
-                status_text.text(f"🎨 画像{i}/{total_images}: {type_icon} {headline_type} '{headline_text}' を生成中...")
+            if not template_frames:
+                st.error("❌ 背景テンプレートが見つかりません。Figma API情報を設定するか、templates/ フォルダに画像を配置してください。")
+                st.stop()
 
-                # 各画像ごとに背景テンプレートを決定
+            # 各画像の背景テンプレート・イラスト素材を先にまとめて決定
+            selections = []
+            for headline_data in headlines:
                 if template_random:
-                    selected_template = random.choice(st.session_state.template_frames)
+                    selected_template = pick_asset(template_frames, render_seed, "template", headline_data['type'], headline_data['text'])
                 elif template_selected:
                     selected_template = template_selected
                 else:
                     st.error("❌ 背景テンプレートを選択してください。")
                     st.stop()
 
-                # 各画像ごとにイラスト素材を決定
                 if illustration_random:
-                    selected_illustration = random.choice(st.session_state.illustration_frames)
+                    # イラスト素材がない場合はイラストなしで描画
+                    selected_illustration = pick_asset(illustration_frames, render_seed, "illustration", headline_data['type'], headline_data['text'])
                 elif illustration_selected:
                     selected_illustration = illustration_selected
                 else:
                     st.error("❌ イラスト素材を選択してください。")
                     st.stop()
 
-                # テンプレート画像とイラスト画像を取得（常に高解像度）
-                template_image = get_high_resolution_template_image(selected_template['id'])
-                illustration_image = get_high_resolution_illustration_image(selected_illustration['id'])
+                selections.append((selected_template, selected_illustration))
+
+            # 描画ジョブと結果の下書きを作成（挿入画像の場合はlayout_horizontalは無視）
+            render_scale = 1 if preview_mode else 2
+            jobs = []
+            drafts = []
+            for headline_data, (selected_template, selected_illustration) in zip(headlines, selections):
+                use_horizontal = layout_horizontal if headline_data['type'] == "アイキャッチ画像" else False
+                jobs.append({
+                    'template_id': selected_template['id'],
+                    'illustration_id': selected_illustration['id'] if selected_illustration else None,
+                    'render_kwargs': {
+                        'title': headline_data['text'],
+                        'subtitle': "",
+                        'layout_horizontal': use_horizontal,
+                        'image_type': headline_data['type']
+                    }
+                })
+                drafts.append({
+                    'headline_text': headline_data['text'],
+                    'headline_type': headline_data['type'],
+                    'template': selected_template,
+                    'illustration': selected_illustration,
+                    'use_horizontal': use_horizontal,
+                    'scale': render_scale,
+                    'mime': OUTPUT_FORMATS[output_format]['mime'],
+                    'output_format': output_format,
+                    'encoder_options': dict(encoder_options)
+                })
 
-                if not template_image:
+            # 前回から変わっていない見出しは結果（素材を含む）をそのまま使う
+            # 素材を固定している場合は、シード値の変更で素材が変わったものも作り直す
+            previous_results = result_store.get(session_id) if incremental else []
+            reused = match_previous_results(drafts, previous_results, match_assets=render_seed is not None)
+
+            # 同じ内容の画像を生成済みならキャッシュから使う
+            cache_keys = [
+                render_cache_key(job['template_id'], job['illustration_id'], job['render_kwargs'], render_scale, output_format, encoder_options)
+                if previous is None else None
+                for job, previous in zip(jobs, reused)
+            ]
+            cached_renders = [get_cached_render(key) if key else None for key in cache_keys]
+            pending = [
+                index for index, (previous, cached) in enumerate(zip(reused, cached_renders))
+                if previous is None and cached is None
+            ]
+
+            # 素材取得と描画を見出し間で並行実行（画像URLは1回で解決）
+            status_text.text("📥 素材画像を取得中...")
+            outcomes = [None] * total_images
+            completed = total_images - len(pending)
+            if completed:
+                progress_bar.progress(completed / total_images)
+            for outcome in iter_render_pipeline([jobs[index] for index in pending], scale=render_scale):
+                index = pending[outcome['index']]
+                i = index + 1
+                outcomes[index] = outcome
+
+                # 進捗表示（完了枚数ベース）
+                completed += 1
+                progress_bar.progress(completed / total_images)
+                headline_type = headlines[i - 1]['type']
+                type_icon = "🖼️" if headline_type == "アイキャッチ画像" else "📝"
+                status_text.text(f"🎨 画像{completed}/{total_images}: {type_icon} {headline_type} '{headlines[i - 1]['text']}' を生成しました")
+
+                if outcome['error'] == 'template':
                     st.error(f"❌ 画像{i}の背景テンプレート画像の取得に失敗しました。")
-                    continue
+                elif outcome['error'] == 'illustration':
+                    st.error(f"❌ 画像{i}のイラスト画像の取得に失敗しました。")
+                elif outcome['error']:
+                    st.error(f"❌ 画像{i}の生成に失敗しました。")
 
-                # 挿入画像の場合はlayout_horizontalは無視
-                use_horizontal = layout_horizontal if headline_type == "アイキャッチ画像" else False
+            # 見出しの順番どおりにセッション状態へ保存（ファイル名は新しい順番で振り直す）
+            for i, (outcome, cached, previous) in enumerate(zip(outcomes, cached_renders, reused), 1):
+                suffix = f"_{i:02d}" if len(headlines) > 1 else ""
+                filename = output_filename(f"generated_image{suffix}", output_format)
 
-                result = create_image_with_text(
-                    template_image=template_image,
-                    title=headline_text,
-                    subtitle="",
-                    layout_horizontal=use_horizontal,
-                    illustration_image=illustration_image,
-                    image_type=headline_type
-                )
+                if previous is not None:
+                    generated_results.append(dict(previous, filename=filename))
+                    continue
 
-                if result and result.get('image'):
-                    result_image = result['image']
+                if cached is not None:
+                    encoded = cached['encoded']
+                    title_lines = cached['title_lines']
+                elif outcome is None or outcome['error']:
+                    continue
+                else:
+                    result = outcome['result']
                     title_lines = result.get('title_lines', [])
+                    # プレビュー・個別ダウンロード・ZIPで使い回すため1度だけエンコード
+                    encoded = image_to_bytes(result['image'], output_format, **encoder_options)
+                    store_cached_render(cache_keys[i - 1], encoded, title_lines)
 
-                    suffix = f"_{i:02d}" if len(headlines) > 1 else ""
-                    filename = f"generated_image{suffix}.png"
-
-                    # セッション状態に保存
-                    result_data = {
-                        'image': result_image,
-                        'filename': filename,
-                        'title_lines': title_lines,
-                        'headline_text': headline_text,
-                        'headline_type': headline_type,
-                        'template': selected_template,
-                        'illustration': selected_illustration,
-                        'use_horizontal': use_horizontal,
-                        'template_image': template_image,
-                        'illustration_image': illustration_image
-                    }
-                    st.session_state.generated_results.append(result_data)
-                else:
-                    st.error(f"❌ 画像{i}の生成に失敗しました。")
+                # 結果ストアに保存（PIL Imageは持たず、フレームIDとエンコード済みバイト列のみ）
+                result_data = dict(drafts[i - 1], filename=filename, title_lines=title_lines, encoded=encoded)
+                generated_results.append(result_data)
+
+            result_store.put(session_id, generated_results)
 
             # 完了時の表示
             progress_bar.progress(1.0)
-            status_text.text(f"✅ 全{total_images}枚の画像生成が完了しました！")
-
-            # 生成された画像を表示（UI整理）
-            if hasattr(st.session_state, 'generated_results') and st.session_state.generated_results:
-                st.markdown("---")
-                st.header("🖼️ 生成結果")
-
-                generated_images = []  # 一括ダウンロード用
-
-                for i, result_data in enumerate(st.session_state.generated_results, 1):
-                    with st.container():
-                        st.subheader(f"画像 {i}: {result_data['headline_type']}")
-
-                        # 画像表示（セッション状態から最新画像を取得）
-                        current_image = st.session_state.generated_results[i-1]['image']
-                        current_filename = st.session_state.generated_results[i-1]['filename']
-
-                        col1, col2 = st.columns([4, 1])
-                        with col1:
-                            st.image(current_image, 
-                                   caption=f"{result_data['headline_text']}", 
-                                   use_container_width=True)
-                        with col2:
-                            # ダウンロードボタン（最新画像）
-                            download_link = create_download_link(current_image, current_filename)
-                            st.markdown(download_link, unsafe_allow_html=True)
-
-                        # 改行調整機能を削除（Streamlitの制約により安定動作が困難なため）
-                        st.info("💡 改行調整: 生成時に自動で適切な改行が適用されます")
-
+            reused_count = sum(1 for previous in reused if previous is not None)
+            if reused_count:
+                status_text.text(f"✅ 全{total_images}枚の画像生成が完了しました！（{reused_count}枚は前回の画像をそのまま使用）")
+            else:
+                status_text.text(f"✅ 全{total_images}枚の画像生成が完了しました！")
+
+    # 生成された画像を表示（UI整理、ボタン操作による再実行後も表示を維持）
+    stored_results = result_store.get(session_id)
+    if stored_results:
+        st.markdown("---")
+        st.header("🖼️ 生成結果")
+
+        generated_images = []  # 一括ダウンロード用（高解像度が揃っているもの）
+
+        for i, result_data in enumerate(stored_results, 1):
+            with st.container():
+                is_preview = result_data.get('scale', 2) != 2
+                st.subheader(f"画像 {i}: {result_data['headline_type']}" + ("（プレビュー）" if is_preview else ""))
+
+                # 画像表示（エンコード済みのバイト列をそのまま使う。破棄済みなら再描画）
+                current_bytes = result_store.get_encoded(session_id, result_data)
+                current_filename = result_data['filename']
+                if current_bytes is None:
+                    st.error(f"❌ 画像{i}の再描画に失敗しました。")
+                    continue
 
-                        generated_images.append((current_image, current_filename))
-                        st.markdown("---")
+                col1, col2 = st.columns([4, 1])
+                with col1:
+                    st.image(current_bytes, 
+                           caption=f"{result_data['headline_text']}", 
+                           use_container_width=True)
+                with col2:
+                    # プレビューの場合は高解像度をダウンロード時に生成
+                    final_bytes = None
+                    if not is_preview or result_data.get('final_encoded'):
+                        final_bytes = result_store.get_final_encoded(session_id, result_data)
+                    elif st.button("🎨 高解像度で書き出し", key=f"finalize_{i}"):
+                        with st.spinner("高解像度で描画中..."):
+                            final_bytes = result_store.get_final_encoded(session_id, result_data)
+                        if final_bytes is None:
+                            st.error(f"❌ 画像{i}の高解像度描画に失敗しました。")
+
+                    if final_bytes is not None:
+                        # ダウンロードボタン（再描画なしでダウンロード）
+                        st.download_button(
+                            f"💾 {current_filename}をダウンロード",
+                            data=final_bytes,
+                            file_name=current_filename,
+                            mime=result_data['mime'],
+                            key=f"download_{i}",
+                            on_click="ignore"
+                        )
+                        generated_images.append((final_bytes, current_filename))
+
+                # 改行調整機能を削除（Streamlitの制約により安定動作が困難なため）
+                st.info("💡 改行調整: 生成時に自動で適切な改行が適用されます")
 
-            # 一括ダウンロードボタン（複数画像の場合）
-            if len(generated_images) > 1:
                 st.markdown("---")
-                st.subheader("📦 一括ダウンロード")
-                zip_download_link = create_zip_download(generated_images)
-                st.markdown(zip_download_link, unsafe_allow_html=True)
+
+        # 一括ダウンロードボタン（複数画像の場合）
+        if len(stored_results) > 1:
+            st.markdown("---")
+            st.subheader("📦 一括ダウンロード")
+
+            if len(generated_images) < len(stored_results):
+                # プレビューのみの画像をまとめて高解像度で描画
+                if st.button("🎨 全て高解像度で書き出し", key="finalize_all"):
+                    finalize_progress = st.progress(0)
+                    failures = result_store.finalize(
+                        session_id,
+                        stored_results,
+                        on_progress=lambda done, total: finalize_progress.progress(done / total)
+                    )
+                    if failures:
+                        st.error(f"❌ {failures}枚の高解像度描画に失敗しました。")
+                    else:
+                        # 各画像のダウンロードボタンも含めて表示し直す
+                        st.rerun()
+
+            if len(generated_images) == len(stored_results):
+                with create_zip_download(generated_images) as zip_file:
+                    st.download_button(
+                        "📦 一括ダウンロード (ZIP)",
+                        data=zip_file,
+                        file_name="generated_images.zip",
+                        mime="application/zip",
+                        key="download_zip",
+                        on_click="ignore"
+                    )
                 st.info(f"🎯 {len(generated_images)}枚の画像をZIPファイルでまとめてダウンロードできます")
 
 if __name__ == "__main__":
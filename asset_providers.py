@@ -0,0 +1,177 @@
+import os
+import logging
+import threading
+from io import BytesIO
+from collections import OrderedDict
+
+from PIL import Image
+from dotenv import load_dotenv
+
+from metrics import timed
+
+# .envファイルを読み込み
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# ローカル素材の配置場所（背景テンプレート・イラスト）
+LOCAL_TEMPLATES_DIR = os.getenv('LOCAL_TEMPLATES_DIR') or os.path.join(BASE_DIR, 'templates')
+LOCAL_ILLUSTRATIONS_DIR = os.getenv('LOCAL_ILLUSTRATIONS_DIR') or os.path.join(BASE_DIR, 'illustrations')
+
+# ローカル素材の書き出し倍率（Figmaの scale=2 と同じ解像度で置く想定）
+LOCAL_ASSET_SCALE = int(os.getenv('LOCAL_ASSET_SCALE', '2'))
+
+# 読み込み済みローカル素材のメモリ上限
+LOCAL_ASSET_CACHE_BYTES = int(os.getenv('LOCAL_ASSET_CACHE_BYTES', str(128 * 1024 * 1024)))  # 既定128MB
+
+LOCAL_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+class AssetProvider:
+    """背景テンプレート・イラスト素材の取得元
+
+    フレームIDは取得元ごとの文字列で、一覧は {'id', 'name'} を持つ辞書のリスト。
+    画像の取得は resolve（まとめて行う前処理）と load_bytes（1枚ずつ、並列実行可）の
+    2段階に分かれている。
+    """
+
+    name = "base"
+
+    def load_manifest(self):
+        """{'background': [...], 'illustration': [...]} を返す（取得できなければNone）"""
+        raise NotImplementedError
+
+    def resolve(self, frame_ids, scale=1, fmt="png"):
+        """load_bytes に渡す前処理結果を {frame_id: handle} で返す（不要なら空）"""
+        return {}
+
+    def load_bytes(self, frame_id, scale=1, fmt="png", handle=None):
+        """フレーム画像のバイト列を返す（取得できなければNone）"""
+        raise NotImplementedError
+
+    def load_many(self, frame_ids, scale=1, fmt="png"):
+        """複数フレームのバイト列を {frame_id: bytes} で返す"""
+        unique_ids = list(dict.fromkeys(frame_ids))
+        handles = self.resolve(unique_ids, scale, fmt)
+        contents = {}
+        for frame_id in unique_ids:
+            try:
+                content = self.load_bytes(frame_id, scale, fmt, handles.get(frame_id))
+            except Exception as e:
+                logger.error("画像取得エラー (%s): %s", frame_id, e)
+                continue
+            if content is not None:
+                contents[frame_id] = content
+        return contents
+
+    def asset_version(self, frame_id):
+        """素材の更新を判別する値（デコード済みキャッシュのキーに使う、なければNone）"""
+        return None
+
+class LocalAssetProvider(AssetProvider):
+    """ローカルディレクトリの画像を素材として使う（Figma APIなしで動作）
+
+    ディレクトリは初回に1度だけ走査し、画像は使う時点で読み込む。
+    読み込んだバイト列は更新時刻ごとにキャッシュし、ファイルが変わっていれば読み直す。
+    """
+
+    name = "local"
+
+    def __init__(self, templates_dir=None, illustrations_dir=None, native_scale=None, cache_bytes=None):
+        self.templates_dir = templates_dir or LOCAL_TEMPLATES_DIR
+        self.illustrations_dir = illustrations_dir or LOCAL_ILLUSTRATIONS_DIR
+        self.native_scale = LOCAL_ASSET_SCALE if native_scale is None else native_scale
+        self.cache_bytes = LOCAL_ASSET_CACHE_BYTES if cache_bytes is None else cache_bytes
+        self._paths = None  # frame_id -> ファイルパス
+        self._manifest = None
+        self._cache = OrderedDict()  # (frame_id, mtime_ns, scale) -> bytes
+        self._cache_size = 0
+        self._lock = threading.Lock()
+
+    def _scan(self, directory, kind):
+        """ディレクトリ内の画像を名前順に一覧化"""
+        frames = []
+        if not os.path.isdir(directory):
+            return frames
+        for name in sorted(os.listdir(directory)):
+            if name.startswith('.') or not name.lower().endswith(LOCAL_IMAGE_EXTENSIONS):
+                continue
+            frame_id = f"local:{kind}/{name}"
+            frames.append(({'id': frame_id, 'name': os.path.splitext(name)[0]}, os.path.join(directory, name)))
+        return frames
+
+    def reindex(self):
+        """ディレクトリを走査し直して素材一覧を作り直す"""
+        templates = self._scan(self.templates_dir, 'background')
+        illustrations = self._scan(self.illustrations_dir, 'illustration')
+        with self._lock:
+            self._paths = {frame['id']: path for frame, path in templates + illustrations}
+            self._manifest = {
+                'background': [frame for frame, _ in templates],
+                'illustration': [frame for frame, _ in illustrations]
+            }
+        return self._manifest
+
+    def load_manifest(self):
+        if self._manifest is None:
+            self.reindex()
+        return {key: list(frames) for key, frames in self._manifest.items()}
+
+    def _path(self, frame_id):
+        if self._paths is None:
+            self.reindex()
+        return self._paths.get(frame_id)
+
+    def asset_version(self, frame_id):
+        path = self._path(frame_id)
+        if path is None:
+            return None
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _read(self, path, scale):
+        """ファイルを読み込み、素材の倍率と違う場合はリサイズしてPNGにする"""
+        with open(path, 'rb') as f:
+            content = f.read()
+        if scale == self.native_scale:
+            return content
+
+        image = Image.open(BytesIO(content))
+        size = (max(1, round(image.width * scale / self.native_scale)), max(1, round(image.height * scale / self.native_scale)))
+        buffer = BytesIO()
+        image.resize(size, Image.Resampling.LANCZOS).save(buffer, format="PNG")
+        return buffer.getvalue()
+
+    def load_bytes(self, frame_id, scale=1, fmt="png", handle=None):
+        path = self._path(frame_id)
+        if path is None:
+            return None
+
+        version = self.asset_version(frame_id)
+        if version is None:
+            return None
+
+        key = (frame_id, version, scale)
+        with self._lock:
+            content = self._cache.get(key)
+            if content is not None:
+                self._cache.move_to_end(key)
+                return content
+
+        with timed("read"):
+            content = self._read(path, scale)
+
+        with self._lock:
+            # 古い更新時刻のものは捨てる
+            for stale_key in [k for k in self._cache if k[0] == frame_id and k[2] == scale and k != key]:
+                self._cache_size -= len(self._cache.pop(stale_key))
+            if key not in self._cache:
+                self._cache[key] = content
+                self._cache_size += len(content)
+                while self._cache_size > self.cache_bytes and len(self._cache) > 1:
+                    _, evicted = self._cache.popitem(last=False)
+                    self._cache_size -= len(evicted)
+        return content
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Template Image Creator ベンチマーク（オフラインで実行）
+
+使い方:
+    python benchmark.py encode            # 出力形式ごとのエンコード時間とサイズ
+    python benchmark.py render            # 描画処理の段階ごとの時間とピークメモリ
+    python benchmark.py render --json result.json              # 結果を保存
+    python benchmark.py render --baseline result.json          # 保存した結果と比較（劣化で終了コード1）
+    python benchmark.py glyphs            # グリフキャッシュと draw.text の描画時間・差分（差が大きいと終了コード1）
+"""
+
+import sys
+import json
+import time
+import resource
+import argparse
+import statistics
+import tracemalloc
+
+from PIL import Image, ImageDraw, ImageChops
+
+from core import (
+    create_image_with_text, encode_image, OUTPUT_FORMATS,
+    get_font, wrap_text, plan_layout, clear_render_caches, draw_text_cached
+)
+
+# 見出しのサンプル（短い・長い・約物が多い）
+HEADLINE_CORPUS = {
+    'short': [
+        "引出物の相場",
+        "前撮りの準備",
+        "ご祝儀の書き方",
+        "招待状の返信",
+        "式場見学のコツ",
+        "ブーケの選び方",
+    ],
+    'long': [
+        "結婚式の引出物で失敗しないために知っておきたい相場と地域ごとの選び方のポイント",
+        "両家顔合わせの食事会をスムーズに進めるための準備チェックリストと当日の流れ",
+        "少人数の家族婚でもゲストに満足してもらえる演出アイデアと費用を抑えるコツ",
+        "海外挙式を検討している方向けのエリア別ベストシーズンと招待ゲストへの配慮",
+        "結婚式の準備期間が短い場合でも間に合わせるためのスケジュールの立て方と優先順位",
+    ],
+    'punctuation': [
+        "「ご祝儀」はいくら？金額の相場と、包み方・渡し方のマナー",
+        "【保存版】招待状の返信はがき、書き方・添え書き・NG例まとめ！",
+        "前撮り？後撮り？それぞれのメリット・デメリットを比較（費用・時期・衣装）",
+        "ゲストの服装マナー：色・丈・小物――迷ったときの『正解』は？",
+        "二次会の幹事を頼まれたら…準備・会費・景品、何から始める？",
+    ],
+}
+
+# 描画処理のレイアウト分岐（名前, image_type, layout_horizontal）
+LAYOUT_BRANCHES = [
+    ('eyecatch_vertical', "アイキャッチ画像", False),
+    ('eyecatch_horizontal', "アイキャッチ画像", True),
+    ('insert', "挿入画像", False),
+]
+
+def make_synthetic_template(size=(2400, 1260)):
+    """フラットな配色のテンプレート（scale=2相当）を合成"""
+    image = Image.new("RGBA", size, (250, 244, 236, 255))
+    draw = ImageDraw.Draw(image)
+    width, height = size
+    draw.rectangle((0, 0, width, 40), fill=(214, 180, 160, 255))
+    draw.rectangle((0, height - 40, width, height), fill=(214, 180, 160, 255))
+    draw.ellipse((width - 360, 60, width - 80, 340), fill=(240, 220, 210, 255))
+    return image
+
+def make_synthetic_illustration(size=(800, 800)):
+    """透過付きのイラスト（scale=2相当）を合成"""
+    image = Image.new("RGBA", size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    width, height = size
+    draw.ellipse((40, 40, width - 40, height - 40), fill=(236, 160, 170, 255), outline=(120, 80, 80, 255), width=12)
+    draw.rectangle((width // 3, height // 3, width * 2 // 3, height * 2 // 3), fill=(255, 255, 255, 255))
+    return image
+
+def time_call(func, repeat):
+    """関数を repeat 回実行し、最短時間（秒）と最後の戻り値を返す"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def bench_encoders(image, repeat=3, quality=90, compress_level=6):
+    """出力形式ごとのエンコード時間（ms）とサイズ（bytes）を計測"""
+    rows = []
+    for output_format in OUTPUT_FORMATS:
+        elapsed, data = time_call(
+            lambda: encode_image(image, output_format, quality=quality, compress_level=compress_level),
+            repeat
+        )
+        rows.append((output_format, elapsed * 1000, len(data)))
+    return rows
+
+def run_encode(args):
+    rendered = create_image_with_text(
+        make_synthetic_template(),
+        "引出物の相場の基本的な考え方",
+        illustration_image=make_synthetic_illustration(),
+        image_type="挿入画像"
+    )
+    rows = bench_encoders(rendered['image'], args.repeat, args.quality, args.compress_level)
+
+    print(f"{'format':<16}{'time(ms)':>12}{'size(bytes)':>14}")
+    for output_format, elapsed_ms, size in rows:
+        print(f"{output_format:<16}{elapsed_ms:>12.1f}{size:>14,}")
+
+def measure_stage(func, repeat, cold=True):
+    """関数を repeat 回実行し、各回の時間（秒）とPython側のピークメモリ（bytes）を返す
+
+    cold=True の場合は毎回キャッシュを空にしてから計測する（初回描画相当）。
+    PIL画像のピクセルデータは tracemalloc の対象外なので、プロセス全体の
+    最大RSSは別途 max_rss_kb() で確認する。
+    """
+    timings = []
+    peak = 0
+    for _ in range(repeat):
+        if cold:
+            clear_render_caches()
+        tracemalloc.start()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return timings, peak
+
+def max_rss_kb():
+    """プロセスの最大RSS（KB、Linux基準）"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def stage_row(name, timings, peak):
+    return {
+        'stage': name,
+        'best_ms': min(timings) * 1000,
+        'median_ms': statistics.median(timings) * 1000,
+        'peak_kb': peak / 1024
+    }
+
+def bench_render_stages(repeat=5, cold=True, output_format="png", zip_count=10):
+    """wrap_text・レイアウト分岐ごとの描画・image_to_bytes・create_zip_download を計測"""
+    # app.py の関数を計測するため、Streamlit のimportはここで行う
+    from app import image_to_bytes, create_zip_download
+
+    template = make_synthetic_template()
+    illustration = make_synthetic_illustration()
+    title_font = get_font(120)
+    max_width = int(template.width * 0.8)
+    rows = []
+
+    for category, headlines in HEADLINE_CORPUS.items():
+        timings, peak = measure_stage(
+            lambda: [wrap_text(None, headline, title_font, max_width) for headline in headlines],
+            repeat, cold
+        )
+        rows.append(stage_row(f"wrap_text/{category}", timings, peak))
+
+    rendered = None
+    for branch, image_type, layout_horizontal in LAYOUT_BRANCHES:
+        for category, headlines in HEADLINE_CORPUS.items():
+            timings, peak = measure_stage(
+                lambda: [plan_layout(template.size, headline, "", layout_horizontal, illustration.size, None, image_type) for headline in headlines],
+                repeat, cold
+            )
+            rows.append(stage_row(f"layout/{branch}/{category}", timings, peak))
+
+            def render():
+                return [
+                    create_image_with_text(template, headline, layout_horizontal=layout_horizontal,
+                                           illustration_image=illustration, image_type=image_type, illustration_id="bench")
+                    for headline in headlines
+                ]
+            timings, peak = measure_stage(render, repeat, cold)
+            rows.append(stage_row(f"render/{branch}/{category}", timings, peak))
+
+            if rendered is None:
+                rendered = render()[0]['image']
+
+    timings, peak = measure_stage(lambda: image_to_bytes(rendered, output_format), repeat, cold=False)
+    rows.append(stage_row(f"image_to_bytes/{output_format}", timings, peak))
+
+    encoded = image_to_bytes(rendered, output_format)
+    files = [(encoded, f"generated_image_{i:02d}.{OUTPUT_FORMATS[output_format]['extension']}") for i in range(1, zip_count + 1)]
+
+    def build_zip():
+        with create_zip_download(files):
+            pass
+    timings, peak = measure_stage(build_zip, repeat, cold=False)
+    rows.append(stage_row(f"create_zip_download/{zip_count}", timings, peak))
+
+    return rows
+
+def compare_with_baseline(rows, baseline, threshold):
+    """基準結果より中央値が threshold 倍を超えて遅くなった段階を返す"""
+    baseline_rows = {row['stage']: row for row in baseline.get('stages', [])}
+    regressions = []
+    for row in rows:
+        base = baseline_rows.get(row['stage'])
+        if base and base['median_ms'] > 0 and row['median_ms'] > base['median_ms'] * threshold:
+            regressions.append((row['stage'], base['median_ms'], row['median_ms']))
+    return regressions
+
+def run_render(args):
+    rows = bench_render_stages(args.repeat, not args.warm, args.format, args.zip_count)
+
+    print(f"{'stage':<44}{'best(ms)':>10}{'median(ms)':>12}{'py peak(KB)':>13}")
+    for row in rows:
+        print(f"{row['stage']:<44}{row['best_ms']:>10.2f}{row['median_ms']:>12.2f}{row['peak_kb']:>13.1f}")
+    print(f"max RSS: {max_rss_kb() / 1024:.1f} MB")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'cold': not args.warm, 'repeat': args.repeat, 'stages': rows, 'max_rss_kb': max_rss_kb()}, f, indent=2)
+        print(f"💾 結果を保存しました: {args.json}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(rows, baseline, args.threshold)
+        for stage, base_ms, current_ms in regressions:
+            print(f"⚠️ {stage}: {base_ms:.2f}ms → {current_ms:.2f}ms")
+        if regressions:
+            print(f"❌ {len(regressions)}段階が基準より{args.threshold:.2f}倍以上遅くなっています")
+            return 1
+        print("✅ 基準からの劣化はありません")
+    return 0
+
+def compare_glyph_rendering(headlines, font_size=120, repeat=3):
+    """draw.text とグリフキャッシュで同じ行を描き、時間と差分を返す
+
+    差分は (最大の画素差, 差が出た画素の割合) で返す。
+    """
+    font = get_font(font_size)
+    size = (int(max(font.getlength(line) for line in headlines)) + font_size, font_size * 2)
+    fill = (0, 0, 0, 255)
+
+    def render(use_cache):
+        images = []
+        for line in headlines:
+            image = Image.new("RGBA", size, (250, 244, 236, 255))
+            if use_cache:
+                draw_text_cached(image, (font_size // 2, font_size // 4), line, font, fill)
+            else:
+                ImageDraw.Draw(image).text((font_size // 2, font_size // 4), line, font=font, fill=fill)
+            images.append(image)
+        return images
+
+    direct_seconds, expected = time_call(lambda: render(False), repeat)
+    render(True)  # グリフをキャッシュに載せてから計測
+    cached_seconds, actual = time_call(lambda: render(True), repeat)
+
+    max_diff = 0
+    changed = 0
+    total = 0
+    for a, b in zip(expected, actual):
+        diff = ImageChops.difference(a.convert("L"), b.convert("L"))
+        max_diff = max(max_diff, diff.getextrema()[1])
+        histogram = diff.histogram()
+        changed += sum(histogram[1:])
+        total += a.width * a.height
+    return direct_seconds, cached_seconds, max_diff, changed / total
+
+def run_glyphs(args):
+    headlines = [headline for category in HEADLINE_CORPUS.values() for headline in category]
+    direct_seconds, cached_seconds, max_diff, changed_ratio = compare_glyph_rendering(headlines, args.font_size, args.repeat)
+
+    print(f"draw.text:    {direct_seconds * 1000:.1f}ms")
+    print(f"glyph cache:  {cached_seconds * 1000:.1f}ms")
+    print(f"max diff:     {max_diff}  changed pixels: {changed_ratio * 100:.3f}%")
+    if changed_ratio > args.tolerance:
+        print(f"❌ 差分のある画素が許容値（{args.tolerance * 100:.3f}%）を超えています")
+        return 1
+    print("✅ 許容範囲内です")
+    return 0
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="画像生成処理のベンチマーク")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    encode = subparsers.add_parser("encode", help="出力形式ごとのエンコード時間とサイズ")
+    encode.add_argument("--repeat", type=int, default=3, help="計測回数（最短時間を採用）")
+    encode.add_argument("--quality", type=int, default=90, help="WebP/JPEGの画質")
+    encode.add_argument("--compress-level", type=int, default=6, help="PNGの圧縮レベル")
+    encode.set_defaults(func=run_encode)
+
+    render = subparsers.add_parser("render", help="描画処理の段階ごとの時間とピークメモリ")
+    render.add_argument("--repeat", type=int, default=5, help="計測回数")
+    render.add_argument("--warm", action="store_true", help="キャッシュを残したまま計測する（既定は毎回空にする）")
+    render.add_argument("-f", "--format", default="png", choices=list(OUTPUT_FORMATS.keys()), help="image_to_bytes の出力形式")
+    render.add_argument("--zip-count", type=int, default=10, help="ZIPにまとめる画像数")
+    render.add_argument("--json", help="結果をJSONで保存するパス")
+    render.add_argument("--baseline", help="比較する基準結果（JSON）")
+    render.add_argument("--threshold", type=float, default=1.25, help="劣化とみなす中央値の倍率（既定: 1.25）")
+    render.set_defaults(func=run_render)
+
+    glyphs = subparsers.add_parser("glyphs", help="グリフキャッシュと draw.text の比較")
+    glyphs.add_argument("--repeat", type=int, default=3, help="計測回数（最短時間を採用）")
+    glyphs.add_argument("--font-size", type=int, default=120, help="フォントサイズ")
+    glyphs.add_argument("--tolerance", type=float, default=0.01, help="差分のある画素の許容割合（既定: 0.01）")
+    glyphs.set_defaults(func=run_glyphs)
+
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    return args.func(args) or 0
+
+if __name__ == "__main__":
+    sys.exit(main())
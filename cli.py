@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Template Image Creator バッチ生成スクリプト（Streamlitなしで実行）
+
+使い方:
+    python cli.py articles/                 # ディレクトリ内の *.md を全て処理
+    python cli.py "articles/**/*.md" -w 8   # globで指定、8プロセスで描画
+    python cli.py articles/ --dry-run       # 描画せずにレイアウトのはみ出しだけ確認
+"""
+
+import os
+import sys
+import glob
+import time
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from core import (
+    get_template_frames, get_illustration_frames, get_asset_manifest, install_asset_manifest, fetch_frame_images, fetch_frame_image, get_decoded_frame,
+    create_image_with_text, parse_multiple_headlines, preload_fonts, plan_layout,
+    encode_image, output_filename, pick_asset, OUTPUT_FORMATS
+)
+import metrics
+
+def collect_markdown_files(patterns):
+    """ディレクトリ・globパターン・ファイルパスからMarkdownファイル一覧を作成"""
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = glob.glob(os.path.join(pattern, "**", "*.md"), recursive=True)
+        else:
+            matches = glob.glob(pattern, recursive=True)
+        files.extend(sorted(matches))
+
+    # 重複を除いて順番を保持
+    return list(dict.fromkeys(os.path.abspath(path) for path in files))
+
+def build_jobs(markdown_files, template_frames, illustration_frames, output_dir, layout_horizontal=False, output_format="png", seed=None):
+    """各Markdownの見出しごとに描画ジョブを作成（素材はランダム選択、seed 指定時は見出しごとに固定）"""
+    # 入力の共通ディレクトリからの相対パスを出力先に再現（同名の index.md などが上書きし合わないように）
+    input_root = os.path.commonpath([os.path.dirname(path) for path in markdown_files]) if markdown_files else ""
+
+    jobs = []
+    for path in markdown_files:
+        with open(path, encoding='utf-8') as f:
+            headlines = parse_multiple_headlines(f.read())
+
+        relative_dir = os.path.relpath(os.path.dirname(path), input_root)
+        article_dir = os.path.normpath(os.path.join(output_dir, relative_dir, os.path.splitext(os.path.basename(path))[0]))
+        for i, headline in enumerate(headlines, 1):
+            suffix = f"_{i:02d}" if len(headlines) > 1 else ""
+            template = pick_asset(template_frames, seed, "template", headline['type'], headline['text'])
+            illustration = pick_asset(illustration_frames, seed, "illustration", headline['type'], headline['text'])
+            jobs.append({
+                'source': path,
+                'output_path': os.path.join(article_dir, output_filename(f"generated_image{suffix}", output_format)),
+                'template_id': template['id'],
+                'illustration_id': illustration['id'] if illustration else None,
+                'title': headline['text'],
+                # 挿入画像の場合はlayout_horizontalは無視
+                'layout_horizontal': layout_horizontal if headline['type'] == "アイキャッチ画像" else False,
+                'image_type': headline['type']
+            })
+    return jobs
+
+def init_worker(asset_manifest):
+    """ワーカープロセスの初期化（spawn で起動しても親と同じ素材一覧・キャッシュを使う）"""
+    install_asset_manifest(asset_manifest)
+
+def render_job(job, scale=2, output_format="png", encoder_options=None):
+    """1枚分を描画して保存（ワーカープロセスで実行）
+
+    戻り値は (出力パス, エラー, このジョブで集計したメトリクス)。
+    """
+    path, error = _render_job(job, scale, output_format, encoder_options)
+    return path, error, metrics.drain()
+
+def _render_job(job, scale, output_format, encoder_options):
+    # 素材は親プロセスでディスクキャッシュに取得済み（素材一覧は init_worker で親から受け取る）
+    template_image = get_decoded_frame(job['template_id'], scale=scale)
+    if template_image is None:
+        return job['output_path'], "背景テンプレート画像の取得に失敗しました"
+
+    illustration_image = fetch_frame_image(job['illustration_id'], scale=scale) if job['illustration_id'] else None
+    if job['illustration_id'] and illustration_image is None:
+        return job['output_path'], "イラスト画像の取得に失敗しました"
+
+    result = create_image_with_text(
+        template_image=template_image,
+        title=job['title'],
+        subtitle="",
+        layout_horizontal=job['layout_horizontal'],
+        illustration_image=illustration_image,
+        image_type=job['image_type'],
+        illustration_id=job['illustration_id'],
+        template_id=job['template_id'],
+        scale=scale
+    )
+    if not result or not result.get('image'):
+        return job['output_path'], "画像の生成に失敗しました"
+
+    os.makedirs(os.path.dirname(job['output_path']), exist_ok=True)
+    with open(job['output_path'], 'wb') as f:
+        f.write(encode_image(result['image'], output_format, **(encoder_options or {})))
+    return job['output_path'], None
+
+def write_metrics(path):
+    """集計したメトリクスをPrometheus形式で書き出す"""
+    text = metrics.render_prometheus()
+    if path == "-":
+        sys.stdout.write(text)
+        return
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    print(f"📈 メトリクスを保存しました: {path}")
+
+def parse_size(value):
+    """"2400x1260" 形式のサイズ指定を (幅, 高さ) に変換"""
+    try:
+        width, height = (int(part) for part in value.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"サイズは 幅x高さ で指定してください: {value}")
+    return width, height
+
+def dry_run(markdown_files, canvas_size, illustration_size, layout_horizontal=False):
+    """描画せずにレイアウトだけを計算し、はみ出す見出しを報告"""
+    start = time.perf_counter()
+    total = 0
+    flagged = []
+    for path in markdown_files:
+        with open(path, encoding='utf-8') as f:
+            headlines = parse_multiple_headlines(f.read())
+
+        for headline in headlines:
+            total += 1
+            use_horizontal = layout_horizontal if headline['type'] == "アイキャッチ画像" else False
+            plan = plan_layout(canvas_size, headline['text'], "", use_horizontal, illustration_size, None, headline['type'])
+            problems = [name for name, overflowed in plan['overflow'].items() if overflowed]
+            if problems:
+                flagged.append((path, headline['text'], problems))
+
+    elapsed = time.perf_counter() - start
+    for path, text, problems in flagged:
+        print(f"⚠️ {os.path.basename(path)}: '{text}' ({', '.join(problems)})")
+    print("-" * 50)
+    print(f"🔍 {total}見出しのレイアウトを確認しました（{elapsed * 1000:.1f}ms, はみ出し {len(flagged)}件）")
+
+    return 1 if flagged else 0
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Markdown記事の見出しから画像を一括生成します")
+    parser.add_argument("paths", nargs="+", help="Markdownファイル・ディレクトリ・globパターン")
+    parser.add_argument("-o", "--output", default="img", help="出力先フォルダ（既定: img）")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1, help="描画プロセス数")
+    parser.add_argument("--horizontal", action="store_true", help="アイキャッチ画像を横並びレイアウトにする")
+    parser.add_argument("-f", "--format", default="png", choices=list(OUTPUT_FORMATS.keys()), help="出力形式（既定: png）")
+    parser.add_argument("--quality", type=int, default=90, help="WebP/JPEGの画質（既定: 90）")
+    parser.add_argument("--compress-level", type=int, default=6, help="PNGの圧縮レベル 0-9（既定: 6）")
+    parser.add_argument("--dry-run", action="store_true", help="描画せずにレイアウトのはみ出しだけを確認する")
+    parser.add_argument("--canvas", type=parse_size, default=(2400, 1260), help="ドライラン時のキャンバスサイズ（既定: 2400x1260）")
+    parser.add_argument("--illustration-size", type=parse_size, default=(800, 800), help="ドライラン時のイラストサイズ（既定: 800x800）")
+    parser.add_argument("--seed", type=int, default=None, help="素材選択のシード値（指定すると同じ見出しには常に同じ素材を使う）")
+    parser.add_argument("--metrics", metavar="PATH", help="処理段階ごとの時間をPrometheus形式で保存する（- で標準出力）")
+    parser.add_argument("--log-level", default=os.getenv('LOG_LEVEL', 'INFO'), help="ログレベル（DEBUGで描画ごとのレイアウト情報も出力）")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    markdown_files = collect_markdown_files(args.paths)
+    if not markdown_files:
+        print("❌ Markdownファイルが見つかりません")
+        return 1
+
+    if args.dry_run:
+        return dry_run(markdown_files, args.canvas, args.illustration_size, args.horizontal)
+
+    template_frames = get_template_frames()
+    illustration_frames = get_illustration_frames()
+    if not template_frames:
+        print("❌ 背景テンプレートを取得できません（FIGMA_TOKEN / FIGMA_FILEKEY または templates/ フォルダを確認してください）")
+        return 1
+
+    jobs = build_jobs(markdown_files, template_frames, illustration_frames, args.output, args.horizontal, args.format, args.seed)
+    encoder_options = {'quality': args.quality, 'compress_level': args.compress_level}
+    print(f"📝 {len(markdown_files)}記事 / {len(jobs)}見出しを処理します")
+    if not jobs:
+        return 0
+
+    start = time.perf_counter()
+
+    # 使用する素材をまとめて取得してディスクキャッシュに載せる（常に高解像度）
+    frame_ids = [job['template_id'] for job in jobs] + [job['illustration_id'] for job in jobs if job['illustration_id']]
+    fetch_frame_images(frame_ids, scale=2)
+
+    # フォークしたワーカーがフォントデータを共有できるよう先に読み込む
+    preload_fonts()
+
+    # 親プロセスの集計をワーカーに複製させないよう、起動前に取り出しておく
+    parent_metrics = metrics.drain()
+
+    failures = 0
+    # Figmaファイルの版をワーカーと揃えるため、親の素材一覧を渡す
+    with ProcessPoolExecutor(max_workers=max(1, args.workers), initializer=init_worker, initargs=(get_asset_manifest(),)) as executor:
+        futures = [executor.submit(render_job, job, 2, args.format, encoder_options) for job in jobs]
+        for completed, future in enumerate(as_completed(futures), 1):
+            try:
+                output_path, error, job_metrics = future.result()
+                metrics.merge(job_metrics)
+            except Exception as e:
+                output_path, error = "?", str(e)
+
+            if error:
+                failures += 1
+                print(f"❌ [{completed}/{len(jobs)}] {output_path}: {error}")
+            else:
+                print(f"✅ [{completed}/{len(jobs)}] {output_path}")
+
+    metrics.merge(parent_metrics)
+    elapsed = time.perf_counter() - start
+    succeeded = len(jobs) - failures
+    throughput = succeeded / elapsed if elapsed > 0 else 0.0
+    print("-" * 50)
+    print(f"✨ {succeeded}/{len(jobs)}枚を生成しました（{elapsed:.1f}秒, {throughput:.2f} images/sec）")
+
+    if args.metrics:
+        write_metrics(args.metrics)
+
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
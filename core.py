@@ -1,5 +1,20 @@
 import os
-import requests
+import json
+import time
+import random
+import math
+import hashlib
+import tempfile
+import mmap
+import struct
+import logging
+import threading
+from http_client import http_get
+from metrics import timed, increment
+from asset_providers import AssetProvider, LocalAssetProvider
+from collections import OrderedDict
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from PIL import Image, ImageDraw, ImageFont
 from io import BytesIO
 from dotenv import load_dotenv
@@ -9,201 +24,836 @@ import textwrap  # テキスト改行機能用
 # .envファイルを読み込み
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # 環境変数から設定を取得
 FIGMA_TOKEN = os.getenv('FIGMA_TOKEN')
 FIGMA_FILEKEY = os.getenv('FIGMA_FILEKEY')
+FIGMA_API_BASE = os.getenv('FIGMA_API_BASE', 'https://api.figma.com').rstrip('/')
 
-def get_template_frames():
-    """Figmaから背景テンプレートフレームを取得"""
+# Figma画像のディスクキャッシュ設定
+ASSET_CACHE_DIR = os.getenv('ASSET_CACHE_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'figma')
+ASSET_CACHE_MAX_BYTES = int(os.getenv('ASSET_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))  # 既定512MB
+# 無圧縮RGBA（.rgba）は1枚が大きいためPNGとは別の上限で管理
+RAW_FRAME_CACHE_MAX_BYTES = int(os.getenv('RAW_FRAME_CACHE_MAX_BYTES', str(2 * 1024 * 1024 * 1024)))  # 既定2GB
+FIGMA_IMAGES_BATCH_SIZE = 50  # /v1/images に1回で渡すフレームID数
+
+# 見出し一括生成時の並列数（ダウンロード・描画それぞれ）
+PIPELINE_MAX_WORKERS = int(os.getenv('PIPELINE_MAX_WORKERS', '4'))
+
+# Figmaファイル内の素材ページ名
+ASSETS_PAGE_NAME = "🛬 Assets"
+
+# 素材の取得元（figma / local / auto: Figma API情報があればFigma、なければローカル）
+ASSET_PROVIDER = os.getenv('ASSET_PROVIDER', 'auto').lower()
+
+# 起動時に全素材を先読みするか（1で有効）と、先読みする倍率・並列数
+ASSET_WARMUP = os.getenv('ASSET_WARMUP', '0') == '1'
+ASSET_WARMUP_SCALES = tuple(int(scale) for scale in os.getenv('ASSET_WARMUP_SCALES', '2,1').split(',') if scale.strip())
+ASSET_WARMUP_WORKERS = int(os.getenv('ASSET_WARMUP_WORKERS', str(PIPELINE_MAX_WORKERS)))
+
+# アセット一覧の有効期間（秒）。過ぎたら古い一覧を返しつつバックグラウンドで取り直す
+ASSET_MANIFEST_TTL = float(os.getenv('ASSET_MANIFEST_TTL', '600'))
+ASSET_MANIFEST_RETRY_INTERVAL = 60  # 取り直しに失敗した場合の再試行間隔（秒）
+
+# 解析済みのアセット一覧（プロセス内の全セッションで共有）
+_asset_manifest = None
+_asset_manifest_loaded_at = 0.0  # 一覧を取得した時刻（time.monotonic）
+_asset_manifest_expires_at = 0.0  # 次に取り直す時刻（time.monotonic）
+_asset_manifest_refreshing = False
+_asset_manifest_generation = 0  # 取得元の差し替えで古い取り直し結果を捨てるための世代
+_asset_manifest_lock = threading.Lock()  # 状態の読み書き用
+_asset_manifest_load_lock = threading.Lock()  # 初回・強制取得を1つにまとめる用
+
+# フォント設定
+FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fonts", "ZenOldMincho-Bold.ttf")
+
+# フォールバック用システムフォント
+FALLBACK_FONTS = [
+    # macOS
+    "/System/Library/Fonts/Arial Unicode.ttc",
+    "/System/Library/Fonts/Hiragino Sans GB.ttc",
+    # Linux (Ubuntu/Streamlit Cloud)
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    # Windows
+    "C:\\Windows\\Fonts\\arial.ttf",
+    "C:\\Windows\\Fonts\\meiryo.ttc"
+]
+
+# 読み込み済みのフォントデータとフォントオブジェクト（プロセス内で共有）
+_font_bytes = {}
+_fonts = {}
+
+def load_font_bytes(font_path):
+    """フォントファイルのバイト列を1度だけ読み込んでメモリに保持"""
+    data = _font_bytes.get(font_path)
+    if data is None:
+        with open(font_path, 'rb') as f:
+            data = f.read()
+        _font_bytes[font_path] = data
+    return data
+
+def resolve_font_path():
+    """使用するフォントファイルをフォールバック順に決定（見つからなければNone）"""
+    for candidate in [FONT_PATH] + FALLBACK_FONTS:
+        try:
+            if os.path.exists(candidate):
+                # 実際に読み込めるか確認
+                ImageFont.truetype(BytesIO(load_font_bytes(candidate)), 12)
+                if candidate == FONT_PATH:
+                    logger.info("フォント読み込み成功: %s", candidate)
+                else:
+                    logger.warning("フォールバックフォント使用: %s", candidate)
+                return candidate
+        except Exception:
+            _font_bytes.pop(candidate, None)
+            continue
+
+    logger.warning("すべてのフォント読み込みに失敗。デフォルトフォントを使用します")
+    return None
+
+# 起動時に1度だけフォールバックチェーンを解決
+RESOLVED_FONT_PATH = resolve_font_path()
+
+def get_font(size, font_path=None):
+    """(フォントパス, サイズ) ごとに1度だけ生成したフォントを返す"""
+    if font_path is None:
+        font_path = RESOLVED_FONT_PATH
+
+    key = (font_path, size)
+    font = _fonts.get(key)
+    if font is None:
+        if font_path is None:
+            try:
+                # デフォルトフォントでもサイズ指定を試行
+                font = ImageFont.load_default(size=size)
+            except Exception:
+                # 古いPillowバージョンの場合
+                font = ImageFont.load_default()
+        else:
+            font = ImageFont.truetype(BytesIO(load_font_bytes(font_path)), size)
+        _fonts[key] = font
+    return font
+
+def preload_fonts(sizes=(120, 80)):
+    """よく使うサイズのフォントを事前に読み込む（ワーカープロセス起動前に呼ぶと共有される）"""
+    for size in sizes:
+        get_font(size)
+
+def _figma_file_version():
+    """取得済みの素材一覧にあるFigmaファイルの版（ローカル素材・未取得ならNone）"""
+    manifest = _asset_manifest
+    return manifest.get("version") if manifest else None
+
+def _asset_cache_path(frame_id, scale, fmt):
+    """キャッシュファイルのパスを返す（ファイルキー・版・フレームID・スケール・形式から決定）
+
+    Figmaファイルが更新されると版が変わり、古い画像は読まれなくなる（LRUで削除される）。
+    Figma素材で版が分からない（素材一覧を読み込んでいない）場合は、古い画像を
+    読み書きしないよう None を返し、キャッシュを使わない。
+    """
+    version = _figma_file_version()
+    if version is None:
+        if get_asset_provider().name == "figma":
+            return None
+        file_key = FIGMA_FILEKEY
+    else:
+        file_key = f"{FIGMA_FILEKEY}@{version}"
+    key = f"{file_key}:{frame_id}:{scale}:{fmt}"
+    digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+    return os.path.join(ASSET_CACHE_DIR, digest[:2], f"{digest}.{fmt}")
+
+def read_cached_asset(frame_id, scale=1, fmt="png"):
+    """キャッシュ済みの画像バイト列を返す（なければNone）"""
+    path = _asset_cache_path(frame_id, scale, fmt)
+    if path is None:
+        return None
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        # LRU判定用に最終利用時刻を更新
+        os.utime(path, None)
+        increment("asset_cache_hit")
+        return data
+    except OSError:
+        increment("asset_cache_miss")
+        return None
+
+def _asset_cache_exists(frame_id, scale=1, fmt="png"):
+    """キャッシュ済みかどうかを読み込まずに返す"""
+    path = _asset_cache_path(frame_id, scale, fmt)
+    return path is not None and os.path.exists(path)
+
+def write_cached_asset(frame_id, data, scale=1, fmt="png"):
+    """画像バイト列をキャッシュへアトミックに書き込む"""
+    path = _asset_cache_path(frame_id, scale, fmt)
+    if path is None:
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 同じディレクトリに一時ファイルを書いてから置き換える（途中状態を読ませない）
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        # 先読み中はまとめて書き込むため、削除は終了後に1度だけ行う
+        with _eviction_lock:
+            deferred = _eviction_deferred > 0
+        if not deferred:
+            evict_asset_cache()
+    except OSError as e:
+        logger.error("キャッシュ書き込みエラー: %s", e)
+
+_eviction_deferred = 0  # 0より大きい間は書き込みごとの削除を行わない
+_eviction_lock = threading.Lock()
+
+class defer_asset_cache_eviction:
+    """with ブロックの間はキャッシュの削除を止め、抜けるときに1度だけ行う
+
+    書き込みごとにキャッシュ全体を走査しないよう、まとめて書き込む処理で使う。
+    """
+
+    def __enter__(self):
+        global _eviction_deferred
+        with _eviction_lock:
+            _eviction_deferred += 1
+        return self
+
+    def __exit__(self, *exc):
+        global _eviction_deferred
+        with _eviction_lock:
+            _eviction_deferred -= 1
+            deferred = _eviction_deferred > 0
+        if not deferred:
+            evict_asset_cache()
+        return False
+
+def _evict_entries(entries, max_bytes):
+    """(最終利用時刻, サイズ, パス) の一覧から、合計が上限以下になるまで古い順に削除"""
+    total = sum(size for _, size, _ in entries)
+    if total <= max_bytes:
+        return
+
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            continue
+
+def evict_asset_cache(max_bytes=None, raw_max_bytes=None):
+    """キャッシュ合計サイズが上限を超えたら最終利用の古い順に削除
+
+    PNGなどの画像（max_bytes）と無圧縮RGBA（raw_max_bytes）は別々の上限で管理する。
+    """
+    if max_bytes is None:
+        max_bytes = ASSET_CACHE_MAX_BYTES
+    if raw_max_bytes is None:
+        raw_max_bytes = RAW_FRAME_CACHE_MAX_BYTES
+
+    images = []
+    raw_frames = []
+    for root, _, files in os.walk(ASSET_CACHE_DIR):
+        for name in files:
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            (raw_frames if name.endswith('.rgba') else images).append((st.st_mtime, st.st_size, path))
+
+    _evict_entries(images, max_bytes)
+    _evict_entries(raw_frames, raw_max_bytes)
+
+def resolve_frame_image_urls(frame_ids, scale=1, fmt="png"):
+    """複数フレームの画像URLをまとめて解決（ids=a,b,c でまとめてAPIを呼ぶ）"""
     if not FIGMA_TOKEN or not FIGMA_FILEKEY:
-        return []
-        
+        return {}
+
     headers = {"X-Figma-Token": FIGMA_TOKEN}
-    url = f"https://api.figma.com/v1/files/{FIGMA_FILEKEY}"
-    
+    unique_ids = list(dict.fromkeys(frame_ids))
+    image_urls = {}
+
+    # URL長の制限を避けるため一定数ごとに分割
+    for start in range(0, len(unique_ids), FIGMA_IMAGES_BATCH_SIZE):
+        chunk = unique_ids[start:start + FIGMA_IMAGES_BATCH_SIZE]
+        url = f"{FIGMA_API_BASE}/v1/images/{FIGMA_FILEKEY}?ids={','.join(chunk)}&format={fmt}&scale={scale}"
+
+        with timed("resolve"):
+            res = http_get(url, headers=headers)
+        if res.status_code != 200:
+            continue
+
+        data = res.json()
+        for frame_id, image_url in (data.get("images") or {}).items():
+            if image_url:
+                image_urls[frame_id] = image_url
+
+    return image_urls
+
+def download_frame_image_bytes(frame_id, image_url, scale=1, fmt="png"):
+    """解決済みURLから画像をダウンロードしてキャッシュに保存"""
+    with timed("download"):
+        img_response = http_get(image_url)
+    if img_response.status_code != 200:
+        return None
+
+    write_cached_asset(frame_id, img_response.content, scale, fmt)
+    return img_response.content
+
+def _fetch_figma_frame_bytes(frame_id, scale=1, fmt="png"):
+    """フレーム画像のバイト列を取得（ディスクキャッシュ優先、なければFigmaから取得して保存）"""
+    if not FIGMA_TOKEN or not FIGMA_FILEKEY:
+        return None
+
+    cached = read_cached_asset(frame_id, scale, fmt)
+    if cached is not None:
+        return cached
+
+    # Figma APIから画像URLを取得
+    image_url = resolve_frame_image_urls([frame_id], scale, fmt).get(frame_id)
+    if not image_url:
+        return None
+
+    # 画像データをダウンロード
+    return download_frame_image_bytes(frame_id, image_url, scale, fmt)
+
+def _fetch_figma_frame_bytes_many(frame_ids, scale=1, fmt="png"):
+    """複数フレームのバイト列をまとめて取得して {frame_id: bytes} を返す
+
+    キャッシュにないフレームだけを1回（ids分割時は数回）のAPI呼び出しで解決し、
+    同じフレームが複数回選ばれていてもダウンロードは1度だけ行う。
+    """
+    if not FIGMA_TOKEN or not FIGMA_FILEKEY:
+        return {}
+
+    contents = {}
+    missing_ids = []
+    for frame_id in dict.fromkeys(frame_ids):
+        cached = read_cached_asset(frame_id, scale, fmt)
+        if cached is not None:
+            contents[frame_id] = cached
+        else:
+            missing_ids.append(frame_id)
+
+    if missing_ids:
+        try:
+            image_urls = resolve_frame_image_urls(missing_ids, scale, fmt)
+        except Exception as e:
+            logger.error("画像URL一括取得エラー: %s", e)
+            image_urls = {}
+        downloaded = {}  # 同一URLの重複ダウンロードを防ぐ
+        for frame_id in missing_ids:
+            image_url = image_urls.get(frame_id)
+            if not image_url:
+                continue
+            try:
+                if image_url in downloaded:
+                    content = downloaded[image_url]
+                    if content is not None:
+                        write_cached_asset(frame_id, content, scale, fmt)
+                else:
+                    content = downloaded[image_url] = download_frame_image_bytes(frame_id, image_url, scale, fmt)
+                if content is not None:
+                    contents[frame_id] = content
+            except Exception as e:
+                logger.error("画像ダウンロードエラー (%s): %s", frame_id, e)
+
+    return contents
+
+def _load_frame_image_bytes(frame_id, image_url, scale, fmt):
+    """キャッシュまたは解決済みURLからフレーム画像のバイト列を取得"""
+    cached = read_cached_asset(frame_id, scale, fmt)
+    if cached is not None:
+        return cached
+    if not image_url:
+        return None
+    return download_frame_image_bytes(frame_id, image_url, scale, fmt)
+
+class FigmaAssetProvider(AssetProvider):
+    """Figmaファイルの 🛬 Assets ページを素材として使う（画像はディスクキャッシュ経由）"""
+
+    name = "figma"
+
+    def load_manifest(self):
+        return load_figma_asset_manifest()
+
+    def resolve(self, frame_ids, scale=1, fmt="png"):
+        # キャッシュにないフレームの画像URLだけをまとめて解決（読み込みは load_bytes で1度だけ）
+        missing_ids = [frame_id for frame_id in dict.fromkeys(frame_ids) if not _asset_cache_exists(frame_id, scale, fmt)]
+        if not missing_ids:
+            return {}
+        try:
+            return resolve_frame_image_urls(missing_ids, scale, fmt)
+        except Exception as e:
+            logger.error("画像URL一括取得エラー: %s", e)
+            return {}
+
+    def load_bytes(self, frame_id, scale=1, fmt="png", handle=None):
+        if handle is not None:
+            return _load_frame_image_bytes(frame_id, handle, scale, fmt)
+        return _fetch_figma_frame_bytes(frame_id, scale, fmt)
+
+    def load_many(self, frame_ids, scale=1, fmt="png"):
+        return _fetch_figma_frame_bytes_many(frame_ids, scale, fmt)
+
+    def asset_version(self, frame_id):
+        # ファイル単位の版（どのフレームを編集しても変わる）
+        return _figma_file_version()
+
+_asset_provider = None
+_asset_provider_lock = threading.Lock()
+
+def create_asset_provider(kind=None):
+    """設定に応じた素材の取得元を作成"""
+    if kind is None:
+        kind = ASSET_PROVIDER
+    if kind == 'auto':
+        kind = 'figma' if FIGMA_TOKEN and FIGMA_FILEKEY else 'local'
+
+    if kind == 'figma':
+        return FigmaAssetProvider()
+    if kind == 'local':
+        return LocalAssetProvider()
+    raise ValueError(f"不明な素材の取得元です: {kind}")
+
+def get_asset_provider():
+    """プロセス共通の素材の取得元を返す"""
+    global _asset_provider
+
+    if _asset_provider is None:
+        with _asset_provider_lock:
+            if _asset_provider is None:
+                _asset_provider = create_asset_provider()
+                logger.info("素材の取得元: %s", _asset_provider.name)
+    return _asset_provider
+
+def set_asset_provider(provider):
+    """素材の取得元を差し替える（アセット一覧も取り直す）"""
+    global _asset_provider, _asset_manifest, _asset_manifest_generation
+
+    with _asset_manifest_lock:
+        _asset_provider = provider
+        _asset_manifest = None
+        _asset_manifest_generation += 1
+
+def fetch_frame_image_bytes(frame_id, scale=1, fmt="png"):
+    """フレーム画像のバイト列を取得（取得元ごとのキャッシュ経由）"""
+    return get_asset_provider().load_bytes(frame_id, scale, fmt)
+
+def fetch_frame_images(frame_ids, scale=1, fmt="png"):
+    """複数フレームの画像をまとめて取得して {frame_id: PIL Image} を返す"""
+    contents = get_asset_provider().load_many(frame_ids, scale, fmt)
+    return {frame_id: Image.open(BytesIO(content)) for frame_id, content in contents.items()}
+
+def fetch_frame_image(frame_id, scale=1, fmt="png"):
+    """フレーム画像をPIL Imageとして取得（ディスクキャッシュ経由）"""
+    content = fetch_frame_image_bytes(frame_id, scale, fmt)
+    if content is None:
+        return None
+    return Image.open(BytesIO(content))
+
+# デコード済みフレーム（テンプレート・イラスト）のプール（よく使うものはメモリ、それ以外は無圧縮ファイル）
+DECODED_TEMPLATE_CACHE_BYTES = int(os.getenv('DECODED_TEMPLATE_CACHE_BYTES', str(256 * 1024 * 1024)))
+_RAW_HEADER = struct.Struct('<4sII')
+_RAW_MAGIC = b'RGBA'
+_decoded_frames = OrderedDict()
+_decoded_frames_bytes = 0
+_decoded_frames_lock = threading.Lock()
+
+def _remember_decoded_frame(key, image):
+    """デコード済み画像をメモリプールに保存（上限を超えたら古いものから削除）"""
+    global _decoded_frames_bytes
+
+    with _decoded_frames_lock:
+        if key in _decoded_frames:
+            _decoded_frames.move_to_end(key)
+            return
+        _decoded_frames[key] = image
+        _decoded_frames_bytes += image.width * image.height * 4
+        while _decoded_frames_bytes > DECODED_TEMPLATE_CACHE_BYTES and len(_decoded_frames) > 1:
+            _, evicted = _decoded_frames.popitem(last=False)
+            _decoded_frames_bytes -= evicted.width * evicted.height * 4
+
+def _read_raw_frame(frame_id, scale, fmt):
+    """無圧縮RGBAファイルをメモリマップして読み込む（PNGの展開なし）"""
+    path = _asset_cache_path(frame_id, scale, f"{fmt}.rgba")
+    if path is None:
+        return None
     try:
-        response = requests.get(url, headers=headers)
-        if response.status_code != 200:
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        os.utime(path, None)
+    except (OSError, ValueError):
+        return None
+
+    if len(mapped) < _RAW_HEADER.size:
+        return None
+    magic, width, height = _RAW_HEADER.unpack_from(mapped)
+    if magic != _RAW_MAGIC or len(mapped) != _RAW_HEADER.size + width * height * 4:
+        return None
+    return Image.frombuffer("RGBA", (width, height), memoryview(mapped)[_RAW_HEADER.size:], "raw", "RGBA", 0, 1)
+
+def _write_raw_frame(frame_id, image, scale, fmt):
+    """RGBA画像を無圧縮ファイルとしてキャッシュに保存"""
+    header = _RAW_HEADER.pack(_RAW_MAGIC, image.width, image.height)
+    write_cached_asset(frame_id, header + image.tobytes(), scale, f"{fmt}.rgba")
+
+def _frame_cache_id(frame_id):
+    """キャッシュのキーに使うフレームID（ローカル素材は更新時刻、Figmaはファイルの版を付ける）"""
+    version = get_asset_provider().asset_version(frame_id)
+    return frame_id if version is None else f"{frame_id}@{version}"
+
+def get_decoded_frame(frame_id, scale=2, fmt="png", content=None):
+    """フレーム画像をデコード済みRGBAとして返す
+
+    メモリプール → 無圧縮ファイル → PNGデコードの順に探す。
+    返す画像は共有されるため、書き換える場合は copy() してから使うこと。
+    content に取得済みのPNGバイト列を渡すとダウンロードを省略する。
+    ローカル素材はファイルの更新時刻ごとに別のキャッシュとして扱う。
+    """
+    cache_id = _frame_cache_id(frame_id)
+    key = (cache_id, scale, fmt)
+    with _decoded_frames_lock:
+        image = _decoded_frames.get(key)
+        if image is not None:
+            _decoded_frames.move_to_end(key)
+            increment("decoded_frame_memory_hit")
+            return image
+
+    image = _read_raw_frame(cache_id, scale, fmt)
+    if image is None:
+        if content is None:
+            content = fetch_frame_image_bytes(frame_id, scale, fmt)
+            if content is None:
+                return None
+        with timed("decode"):
+            image = Image.open(BytesIO(content)).convert("RGBA")
+        _write_raw_frame(cache_id, image, scale, fmt)
+    else:
+        increment("decoded_frame_raw_hit")
+
+    _remember_decoded_frame(key, image)
+    return image
+
+def load_figma_asset_manifest():
+    """🛬 Assets ページだけを浅く取得し、背景・イラストのフレーム一覧を返す"""
+    if not FIGMA_TOKEN or not FIGMA_FILEKEY:
+        return None
+
+    headers = {"X-Figma-Token": FIGMA_TOKEN}
+
+    # depth=1 でページ一覧だけを取得（ドキュメント全体はダウンロードしない）
+    url = f"{FIGMA_API_BASE}/v1/files/{FIGMA_FILEKEY}?depth=1"
+    response = http_get(url, headers=headers)
+    if response.status_code != 200:
+        return None
+
+    data = response.json()
+    pages = data["document"]["children"]
+    # ファイルの版（編集されると変わる）をキャッシュのキーに使う
+    version = data.get("version") or data.get("lastModified")
+    page_ids = [page["id"] for page in pages if page.get("name") == ASSETS_PAGE_NAME]
+    if not page_ids:
+        return {"background": [], "illustration": [], "version": version}
+
+    # Assets ページ配下のセクションとその直下のフレームだけを取得
+    url = f"{FIGMA_API_BASE}/v1/files/{FIGMA_FILEKEY}/nodes?ids={','.join(page_ids)}&depth=2"
+    response = http_get(url, headers=headers)
+    if response.status_code != 200:
+        return None
+
+    nodes = response.json().get("nodes") or {}
+
+    templates = []
+    illustrations = []
+    for page_id in page_ids:
+        page = (nodes.get(page_id) or {}).get("document") or {}
+        for child in page.get("children", []):
+            if child.get("name") == "background":
+                for frame in child.get("children", []):
+                    if frame["type"] == "FRAME":
+                        templates.append({
+                            "id": frame["id"],
+                            "name": frame["name"]
+                        })
+            elif child.get("name") == "illustration" and not illustrations:
+                illustrations.extend(child.get("children", []))
+
+    return {"background": templates, "illustration": illustrations, "version": version}
+
+def load_asset_manifest():
+    """素材の取得元から背景・イラストの一覧を取得"""
+    return get_asset_provider().load_manifest()
+
+def _store_asset_manifest(manifest, generation):
+    """取得した一覧を保存（呼び出し側でロック済み、取得元が変わっていれば捨てる）"""
+    global _asset_manifest, _asset_manifest_loaded_at, _asset_manifest_expires_at
+
+    if generation != _asset_manifest_generation:
+        return
+    now = time.monotonic()
+    if manifest is None:
+        # 失敗した場合は古い一覧を使い続け、少し待ってから再試行
+        _asset_manifest_expires_at = now + min(ASSET_MANIFEST_RETRY_INTERVAL, ASSET_MANIFEST_TTL)
+        return
+    _asset_manifest = manifest
+    _asset_manifest_loaded_at = now
+    _asset_manifest_expires_at = now + ASSET_MANIFEST_TTL
+    logger.info("アセット一覧を取得しました（背景 %d個 / イラスト %d個）", len(manifest['background']), len(manifest['illustration']))
+
+def _load_asset_manifest_safely():
+    """一覧を取得（例外はログに残してNone）"""
+    try:
+        with timed("manifest"):
+            return load_asset_manifest()
+    except Exception as e:
+        logger.error("アセット一覧取得エラー: %s", e)
+        return None
+
+def _refresh_asset_manifest(generation):
+    """バックグラウンドで一覧を取り直す"""
+    global _asset_manifest_refreshing
+
+    try:
+        manifest = _load_asset_manifest_safely()
+        with _asset_manifest_lock:
+            _store_asset_manifest(manifest, generation)
+    finally:
+        with _asset_manifest_lock:
+            _asset_manifest_refreshing = False
+
+def get_asset_manifest(refresh=False):
+    """アセット一覧を取得（プロセス内の全セッションで共有）
+
+    初回と refresh=True の場合はその場で取得する（同時に呼ばれても取得は1回だけ）。
+    有効期間（ASSET_MANIFEST_TTL）を過ぎた一覧はそのまま返し、取り直しは
+    バックグラウンドで1つだけ実行する。
+    """
+    global _asset_manifest_refreshing
+
+    manifest = _asset_manifest
+    if manifest is not None and not refresh:
+        if time.monotonic() >= _asset_manifest_expires_at:
+            with _asset_manifest_lock:
+                if not _asset_manifest_refreshing and time.monotonic() >= _asset_manifest_expires_at:
+                    _asset_manifest_refreshing = True
+                    threading.Thread(
+                        target=_refresh_asset_manifest,
+                        args=(_asset_manifest_generation,),
+                        name="asset-manifest-refresh",
+                        daemon=True
+                    ).start()
+        return manifest
+
+    # 初回・強制取得は1つずつ行い、待っていた呼び出しは取得結果を共有する
+    requested_at = time.monotonic()
+    with _asset_manifest_load_lock:
+        with _asset_manifest_lock:
+            if _asset_manifest is not None and (not refresh or _asset_manifest_loaded_at >= requested_at):
+                return _asset_manifest
+            generation = _asset_manifest_generation
+
+        manifest = _load_asset_manifest_safely()
+        with _asset_manifest_lock:
+            _store_asset_manifest(manifest, generation)
+            return _asset_manifest
+
+def install_asset_manifest(manifest):
+    """取得済みの一覧をこのプロセスの一覧として使う（ワーカープロセスの初期化用）
+
+    spawn で起動したワーカーは親の一覧を持たないため、親から受け取った一覧を
+    入れておくと、Figmaファイルの版が親と揃い同じディスクキャッシュを使える。
+    """
+    if manifest is None:
+        return
+    with _asset_manifest_lock:
+        _store_asset_manifest(manifest, _asset_manifest_generation)
+
+def asset_manifest_status():
+    """アセット一覧の状態を返す（経過秒数・取り直し中かどうか）"""
+    with _asset_manifest_lock:
+        return {
+            'loaded': _asset_manifest is not None,
+            'age_seconds': time.monotonic() - _asset_manifest_loaded_at if _asset_manifest is not None else None,
+            'ttl_seconds': ASSET_MANIFEST_TTL,
+            'refreshing': _asset_manifest_refreshing
+        }
+
+def get_template_frames():
+    """背景テンプレートの一覧を取得"""
+    try:
+        manifest = get_asset_manifest()
+        if manifest is None:
             return []
-            
-        data = response.json()
-        
-        # 🛬 Assets ページの background セクションを探す
-        templates = []
-        for page in data["document"]["children"]:
-            if page.get("name") == "🛬 Assets":
-                for child in page["children"]:
-                    if child.get("name") == "background":
-                        for frame in child["children"]:
-                            if frame["type"] == "FRAME":
-                                templates.append({
-                                    "id": frame["id"],
-                                    "name": frame["name"]
-                                })
-        
-        print(f"✅ テンプレート {len(templates)}個を取得しました")
-        return templates
+
+        return list(manifest["background"])
         
     except Exception as e:
-        print(f"テンプレート取得エラー: {e}")
+        logger.error("テンプレート取得エラー: %s", e)
         return []
 
 def get_template_image(frame_id):
     """指定フレームの画像を取得して表示用PIL Imageとして返す"""
-    if not FIGMA_TOKEN or not FIGMA_FILEKEY:
-        return None
-        
-    headers = {"X-Figma-Token": FIGMA_TOKEN}
-    url = f"https://api.figma.com/v1/images/{FIGMA_FILEKEY}?ids={frame_id}&format=png&scale=1"
-    
     try:
-        # Figma APIから画像URLを取得
-        res = requests.get(url, headers=headers)
-        if res.status_code != 200:
-            return None
-            
-        data = res.json()
-        image_url = data.get("images", {}).get(frame_id)
-        if not image_url:
-            return None
-            
-        # 画像データをダウンロード
-        img_response = requests.get(image_url)
-        if img_response.status_code != 200:
-            return None
-            
-        # PIL Imageとして返す
-        return Image.open(BytesIO(img_response.content))
+        # ディスクキャッシュ経由で取得（なければFigmaからダウンロード）
+        return fetch_frame_image(frame_id, scale=1)
         
     except Exception as e:
-        print(f"画像取得エラー: {e}")
+        logger.error("画像取得エラー: %s", e)
         return None
 
-def get_random_illustration():
+def get_random_illustration(scale=1):
     """ランダムなイラストを取得"""
-    if not FIGMA_TOKEN or not FIGMA_FILEKEY:
-        return None
-        
-    headers = {"X-Figma-Token": FIGMA_TOKEN}
-    url = f"https://api.figma.com/v1/files/{FIGMA_FILEKEY}"
-    
     try:
-        response = requests.get(url, headers=headers)
-        if response.status_code != 200:
+        manifest = get_asset_manifest()
+        if manifest is None:
             return None
-            
-        data = response.json()
-        
-        # 🛬 Assets ページの illustration セクションを探す
-        illustrations = []
-        for page in data["document"]["children"]:
-            if page.get("name") == "🛬 Assets":
-                for child in page["children"]:
-                    if child.get("name") == "illustration":
-                        illustrations.extend(child.get("children", []))
-                        break
-                break
-        
+
+        illustrations = manifest["illustration"]
         if not illustrations:
             return None
             
         # ランダムなイラストを選択
-        import random
         selected = random.choice(illustrations)
         
-        # イラスト画像をダウンロード
-        img_url = f"https://api.figma.com/v1/images/{FIGMA_FILEKEY}?ids={selected['id']}&format=png&scale=1"
-        res = requests.get(img_url, headers=headers)
-        if res.status_code != 200:
-            return None
-            
-        img_data = res.json()
-        image_url = img_data.get("images", {}).get(selected['id'])
-        if not image_url:
-            return None
-            
-        # 画像データをダウンロード
-        img_response = requests.get(image_url)
-        if img_response.status_code == 200:
-            return Image.open(BytesIO(img_response.content))
+        # イラスト画像をダウンロード（ディスクキャッシュ経由）
+        return fetch_frame_image(selected['id'], scale=scale)
             
     except Exception as e:
-        print(f"イラスト取得エラー: {e}")
+        logger.error("イラスト取得エラー: %s", e)
         
     return None
 
 def get_illustration_frames():
-    """Figmaからイラスト素材フレームを取得"""
-    if not FIGMA_TOKEN or not FIGMA_FILEKEY:
-        return []
-        
-    headers = {"X-Figma-Token": FIGMA_TOKEN}
-    url = f"https://api.figma.com/v1/files/{FIGMA_FILEKEY}"
-    
+    """イラスト素材の一覧を取得"""
     try:
-        response = requests.get(url, headers=headers)
-        if response.status_code != 200:
+        manifest = get_asset_manifest()
+        if manifest is None:
             return []
-            
-        data = response.json()
-        
-        # 🛬 Assets ページの illustration セクションを探す
-        illustrations = []
-        for page in data["document"]["children"]:
-            if page.get("name") == "🛬 Assets":
-                for child in page["children"]:
-                    if child.get("name") == "illustration":
-                        illustrations.extend(child.get("children", []))
-                        break
-                break
-        
-        return illustrations
+
+        return list(manifest["illustration"])
         
     except Exception as e:
-        print(f"イラスト素材フレーム取得エラー: {e}")
+        logger.error("イラスト素材フレーム取得エラー: %s", e)
         return []
 
 def get_illustration_image(frame_id):
     """指定フレームのイラスト画像を取得してPIL Imageとして返す"""
-    if not FIGMA_TOKEN or not FIGMA_FILEKEY:
-        return None
-        
-    headers = {"X-Figma-Token": FIGMA_TOKEN}
-    url = f"https://api.figma.com/v1/images/{FIGMA_FILEKEY}?ids={frame_id}&format=png&scale=1"
-    
     try:
-        # Figma APIから画像URLを取得
-        res = requests.get(url, headers=headers)
-        if res.status_code != 200:
-            return None
-            
-        data = res.json()
-        image_url = data.get("images", {}).get(frame_id)
-        if not image_url:
-            return None
-            
-        # 画像データをダウンロード
-        img_response = requests.get(image_url)
-        if img_response.status_code != 200:
-            return None
-            
-        # PIL Imageとして返す
-        return Image.open(BytesIO(img_response.content))
+        # ディスクキャッシュ経由で取得（なければFigmaからダウンロード）
+        return fetch_frame_image(frame_id, scale=1)
         
     except Exception as e:
-        print(f"イラスト画像取得エラー: {e}")
+        logger.error("イラスト画像取得エラー: %s", e)
         return None
 
+# 文字幅の計測キャッシュ（フォント・文字単位で1度だけ計測）
+_glyph_metrics = OrderedDict()
+_kerning_pairs = OrderedDict()
+_line_widths = OrderedDict()
+_text_metrics_lock = threading.Lock()  # 描画スレッド間で共有する3つのキャッシュ用
+GLYPH_METRICS_CACHE_SIZE = 8192
+KERNING_PAIR_CACHE_SIZE = 16384
+LINE_WIDTH_CACHE_SIZE = 4096
+
+def _cache_get(cache, key):
+    """キャッシュから値を取り出し、最近使ったものとして記録（なければNone）"""
+    with _text_metrics_lock:
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+def _cache_put(cache, key, value, max_size):
+    """キャッシュに値を保存し、上限を超えたら古いものから削除"""
+    with _text_metrics_lock:
+        cache[key] = value
+        cache.move_to_end(key)
+        if len(cache) > max_size:
+            cache.popitem(last=False)
+
+def _get_glyph_metrics(font, char):
+    """文字の送り幅と左右の描画端を返す（フォント・文字ごとにキャッシュ）"""
+    key = (font, char)
+    metrics = _cache_get(_glyph_metrics, key)
+    if metrics is None:
+        left, _, right, _ = font.getbbox(char)
+        metrics = (font.getlength(char), left, right)
+        _cache_put(_glyph_metrics, key, metrics, GLYPH_METRICS_CACHE_SIZE)
+    return metrics
+
+def _get_kerning(font, first, second):
+    """2文字間のカーニング量を返す（フォントが持たない場合は0）"""
+    key = (font, first + second)
+    kerning = _cache_get(_kerning_pairs, key)
+    if kerning is None:
+        kerning = font.getlength(first + second) - _get_glyph_metrics(font, first)[0] - _get_glyph_metrics(font, second)[0]
+        _cache_put(_kerning_pairs, key, kerning, KERNING_PAIR_CACHE_SIZE)
+    return kerning
+
+def _text_positions(font, text):
+    """各文字の描画開始位置（送り幅とカーニングの累積和）を返す"""
+    positions = [0.0]
+    for k, char in enumerate(text):
+        advance = _get_glyph_metrics(font, char)[0]
+        if k + 1 < len(text):
+            advance += _get_kerning(font, char, text[k + 1])
+        positions.append(positions[-1] + advance)
+    return positions
+
+def _span_width(font, text, positions, start, end):
+    """text[start:end] の描画幅（textbbox の幅に相当）を累積和から求める"""
+    if end <= start:
+        return 0
+    left = _get_glyph_metrics(font, text[start])[1]
+    right = _get_glyph_metrics(font, text[end - 1])[2]
+    return math.ceil(positions[end - 1] - positions[start] + right) - left
+
+def _remember_line_width(font, text, width):
+    """計測済みの行幅を保存（後段のレイアウトで再利用）"""
+    _cache_put(_line_widths, (font, text), width, LINE_WIDTH_CACHE_SIZE)
+
+def measure_text_width(font, text):
+    """1行分のテキスト幅を返す（計測結果はキャッシュして再利用）"""
+    width = _cache_get(_line_widths, (font, text))
+    if width is None:
+        width = _span_width(font, text, _text_positions(font, text), 0, len(text))
+        _remember_line_width(font, text, width)
+    return width
+
 def wrap_text(draw, text, font, max_width):
-    """テキストを指定幅で自然に改行（句読点が行頭に来ないように）"""
+    """テキストを指定幅で自然に改行（句読点が行頭に来ないように）
+
+    文字ごとの送り幅を1度だけ計測し、累積和から行幅を求めるので
+    見出しの長さに対して線形時間で改行位置が決まる。
+    """
+    with timed("wrap"):
+        return _wrap_lines(text, font, max_width)
+
+def _wrap_lines(text, font, max_width):
+    """wrap_text の本体"""
     if not text:
         return []
     
     # まず全体のテキスト幅をチェック
-    bbox = draw.textbbox((0, 0), text, font=font)
-    text_width = bbox[2] - bbox[0]
+    positions = _text_positions(font, text)
+    text_width = _span_width(font, text, positions, 0, len(text))
     
     if text_width <= max_width:
+        _remember_line_width(font, text, text_width)
         return [text]  # 改行不要
     
     # 禁則文字（行頭に来てはいけない文字）
@@ -217,24 +867,23 @@ def wrap_text(draw, text, font, max_width):
     break_chars = ['の', 'を', 'に', 'で', 'と', 'が', 'は', 'も', 'へ', 'から', 'まで', ' ', '　']
     
     # 文字単位で改行処理（禁則処理対応＋自然な区切り優先）
+    # 現在行は常に text[start:i] の連続した部分文字列
     lines = []
-    current_line = ""
+    start = 0
     
     i = 0
     while i < len(text):
         char = text[i]
-        test_line = current_line + char
-        bbox = draw.textbbox((0, 0), test_line, font=font)
-        test_width = bbox[2] - bbox[0]
+        test_width = _span_width(font, text, positions, start, i + 1)
         
         if test_width <= max_width:
-            current_line = test_line
             i += 1
         else:
             # 改行が必要な場合
-            if current_line:
+            if i > start:
+                current_line = text[start:i]
                 # 禁則処理：次の文字が禁則文字なら、現在行に含める
-                if i < len(text) and text[i] in forbidden_start_chars:
+                if text[i] in forbidden_start_chars:
                     # 禁則文字を現在行に追加（幅を超えても）
                     current_line += char
                     i += 1
@@ -250,368 +899,952 @@ def wrap_text(draw, text, font, max_width):
                             break
                 
                 # 最適な位置で改行
-                if best_break < len(current_line):
-                    lines.append(current_line[:best_break])
-                    current_line = current_line[best_break:]
-                else:
-                    lines.append(current_line)
-                    current_line = ""
+                lines.append(current_line[:best_break])
+                start += best_break
             else:
                 # 1文字でも収まらない場合は強制的に追加
                 lines.append(char)
                 i += 1
+                start = i
     
-    if current_line:
-        lines.append(current_line)
+    if start < len(text):
+        lines.append(text[start:])
+    
+    # 各行の幅を後段（中央揃えなど）で再利用できるよう保存
+    line_start = 0
+    for line in lines:
+        _remember_line_width(font, line, _span_width(font, text, positions, line_start, line_start + len(line)))
+        line_start += len(line)
     
     return lines
 
-def create_image_with_text(template_image, title, subtitle="", layout_horizontal=False, illustration_image=None, title_manual_lines=None, image_type="アイキャッチ画像"):
-    """テンプレート画像にテキストとイラストを追加して新しい画像を生成"""
-    if template_image is None:
-        return None
+# 描画済みグリフのマスク（フォント・文字単位、サイズはフォントに含まれる）
+GLYPH_ATLAS = os.getenv('GLYPH_ATLAS', '1') == '1'
+GLYPH_ATLAS_CACHE_BYTES = int(os.getenv('GLYPH_ATLAS_CACHE_BYTES', str(32 * 1024 * 1024)))
+_glyph_masks = OrderedDict()
+_glyph_masks_bytes = 0
+_glyph_masks_lock = threading.Lock()
+
+def _get_glyph_mask(font, char):
+    """文字のアンチエイリアス済みマスクと、ペン位置からのオフセットを返す
+
+    (mask, left, top) を返す。空白など描画するピクセルがない文字は mask が None。
+    """
+    global _glyph_masks_bytes
+
+    key = (font, char)
+    with _glyph_masks_lock:
+        glyph = _glyph_masks.get(key)
+        if glyph is not None:
+            _glyph_masks.move_to_end(key)
+            return glyph
+
+    left, top, right, bottom = font.getbbox(char)
+    mask = None
+    if right > left and bottom > top:
+        mask = Image.new("L", (right - left, bottom - top), 0)
+        ImageDraw.Draw(mask).text((-left, -top), char, font=font, fill=255)
+    glyph = (mask, left, top)
+
+    with _glyph_masks_lock:
+        if key not in _glyph_masks:
+            _glyph_masks[key] = glyph
+            _glyph_masks_bytes += mask.width * mask.height if mask is not None else 0
+            # 上限を超えたら古いものから削除
+            while _glyph_masks_bytes > GLYPH_ATLAS_CACHE_BYTES and len(_glyph_masks) > 1:
+                _, (evicted, _, _) = _glyph_masks.popitem(last=False)
+                _glyph_masks_bytes -= evicted.width * evicted.height if evicted is not None else 0
+    return glyph
+
+def draw_text_cached(image, xy, text, font, fill):
+    """キャッシュしたグリフのマスクを並べてテキストを描画する
+
+    ペン位置は wrap_text と同じ送り幅・カーニングの累積和から求める。
+    draw.text と比べてサブピクセル位置の丸め分だけ輪郭がずれることがある。
+    """
+    x, y = xy
+    positions = _text_positions(font, text)
+    for k, char in enumerate(text):
+        mask, left, top = _get_glyph_mask(font, char)
+        if mask is not None:
+            image.paste(fill, (int(round(x + positions[k])) + left, int(round(y)) + top), mask)
+
+def draw_text(image, draw, xy, text, font, fill):
+    """テキストを描画（FreeTypeフォントならグリフのキャッシュを使う）"""
+    if GLYPH_ATLAS and isinstance(font, ImageFont.FreeTypeFont):
+        draw_text_cached(image, xy, text, font, fill)
+    else:
+        draw.text(xy, text, font=font, fill=fill)
+
+# リサイズ済みイラストのキャッシュ（フレームID・サイズ・フィルタ単位）
+RESIZED_ILLUSTRATION_CACHE_BYTES = int(os.getenv('RESIZED_ILLUSTRATION_CACHE_BYTES', str(256 * 1024 * 1024)))
+_resized_illustrations = OrderedDict()
+_resized_illustrations_bytes = 0
+_resized_illustrations_lock = threading.Lock()
+
+def resize_illustration(illustration, size, illustration_id=None, resample=Image.Resampling.LANCZOS):
+    """イラストをリサイズしてRGBAで返す（フレームIDがあれば結果をキャッシュ）
+
+    返す画像はキャッシュと共有されるため、呼び出し側で書き換えないこと。
+    """
+    global _resized_illustrations_bytes
+
+    if illustration_id is None:
+        with timed("resize"):
+            resized = illustration.resize(size, resample)
+            return resized if resized.mode == 'RGBA' else resized.convert('RGBA')
+
+    # ローカル素材は更新時刻ごとに別のキャッシュとして扱う（編集後に古い画像を使わない）
+    key = (_frame_cache_id(illustration_id), size[0], size[1], resample)
+    with _resized_illustrations_lock:
+        resized = _resized_illustrations.get(key)
+        if resized is not None:
+            _resized_illustrations.move_to_end(key)
+            increment("resized_illustration_hit")
+            return resized
+
+    with timed("resize"):
+        resized = illustration.resize(size, resample)
+        if resized.mode != 'RGBA':
+            resized = resized.convert('RGBA')
+
+    with _resized_illustrations_lock:
+        if key not in _resized_illustrations:
+            _resized_illustrations[key] = resized
+            _resized_illustrations_bytes += size[0] * size[1] * 4
+            # 上限を超えたら古いものから削除
+            while _resized_illustrations_bytes > RESIZED_ILLUSTRATION_CACHE_BYTES and len(_resized_illustrations) > 1:
+                (_, w, h, _), _ = _resized_illustrations.popitem(last=False)
+                _resized_illustrations_bytes -= w * h * 4
+
+    return resized
+
+def parse_multiple_headlines(text):
+    """見出しを解析し、レベルと内容を抽出"""
+    headlines = []
+    lines = text.split('\n')
+
+    for line in lines:
+        line = line.strip()
+        if line.startswith('###'):  # 見出し3は除外
+            continue
+        elif line.startswith('##'):  # 見出し2（挿入画像）
+            headline_text = line[2:].strip()
+            if headline_text:
+                headlines.append({
+                    'text': headline_text,
+                    'level': 2,
+                    'type': '挿入画像'
+                })
+        elif line.startswith('#'):  # 見出し1（アイキャッチ画像）
+            headline_text = line[1:].strip()
+            if headline_text:
+                headlines.append({
+                    'text': headline_text,
+                    'level': 1,
+                    'type': 'アイキャッチ画像'
+                })
+
+    # 見出しが見つからない場合は全体をアイキャッチとして扱う
+    if not headlines and text.strip():
+        headlines.append({
+            'text': text.strip(),
+            'level': 1,
+            'type': 'アイキャッチ画像'
+        })
+
+    return headlines
+
+# 計算済みレイアウトのキャッシュ件数
+LAYOUT_CACHE_SIZE = 2048
+
+def plan_layout(canvas_size, title, subtitle="", layout_horizontal=False, illustration_size=None, title_manual_lines=None, image_type="アイキャッチ画像", title_font_size=None, subtitle_font_size=None, scale=2):
+    """描画せずにレイアウトだけを計算する（ドライラン用）
+
+    scale はFigma素材の書き出し倍率。フォントサイズ（既定 60px/40px × scale）と
+    余白・行間は scale に比例して決まる（scale=2 が従来の高解像度レイアウト）。
+
+    返す計画（plan）は以下のキーを持つ辞書。描画は rasterize_layout が行う。
+    - title_lines / subtitle_lines: 改行結果
+    - text_boxes: 各行の描画位置 {'text', 'x', 'y', 'width', 'font_size', 'fill'}
+    - illustration_box: イラストの配置 (x, y, 幅, 高さ)。配置しない場合は None
+    - overflow: はみ出し判定 {'text_width', 'text_height', 'illustration_omitted'}
+    - notes: 描画時に出力するログ
+
+    結果は (テキスト, フォント, キャンバスサイズ, …) ごとにキャッシュされ共有されるため、
+    呼び出し側で書き換えないこと。
+    """
+    if title_font_size is None:
+        title_font_size = 60 * scale
+    if subtitle_font_size is None:
+        subtitle_font_size = 40 * scale
+
+    return _plan_layout_cached(
+        tuple(canvas_size),
+        title or "",
+        subtitle or "",
+        bool(layout_horizontal),
+        tuple(illustration_size) if illustration_size else None,
+        tuple(title_manual_lines) if title_manual_lines else None,
+        image_type,
+        RESOLVED_FONT_PATH,
+        title_font_size,
+        subtitle_font_size,
+        scale
+    )
+
+@lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def _plan_layout_cached(canvas_size, title, subtitle, layout_horizontal, illustration_size, title_manual_lines, image_type, font_path, title_font_size, subtitle_font_size, scale):
+    """plan_layout の本体（引数はすべてハッシュ可能な値）"""
+    def px(value):
+        # 余白・行間などの固定値は scale=2 基準なので、描画スケールに合わせて換算
+        return int(round(value * scale / 2))
+
+    title_font = get_font(title_font_size, font_path)
+    subtitle_font = get_font(subtitle_font_size, font_path)
+    img_width, img_height = canvas_size
+
+    text_boxes = []
+    illustration_box = None
+    notes = []
+    title_lines = []
+    subtitle_lines = []
+
+    def add_line(line, x, y, font, font_size, fill):
+        text_boxes.append({
+            'text': line,
+            'x': x,
+            'y': y,
+            'width': measure_text_width(font, line),
+            'font_size': font_size,
+            'fill': fill
+        })
+
+    # 画像タイプによってレイアウトを決定
+    if image_type == "挿入画像":
+        # 挿入画像レイアウト（テキスト中央揃え）
+        notes.append(f"✅ 挿入画像モード: テキスト中央揃え")
         
-    try:
-        # テンプレート画像をコピー
-        image = template_image.copy().convert("RGBA")
-        draw = ImageDraw.Draw(image)
+        # テキスト改行処理（手動指定優先）
+        max_text_width = int(img_width * 0.8)  # 画面の80%幅
         
-        # フォント設定（高解像度対応 - scale=2で120px/80px）
-        # 動的にフォントパスを取得
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        font_path = os.path.join(current_dir, "fonts", "ZenOldMincho-Bold.ttf")
+        if title_manual_lines:
+            title_lines = list(title_manual_lines)
+            notes.append(f"✅ 挿入画像 手動改行使用: {len(title_lines)}行")
+        else:
+            title_lines = wrap_text(None, title, title_font, max_text_width) if title else []
+            notes.append(f"✅ 挿入画像 自動改行: {len(title_lines)}行")
         
-        try:
-            # フォントファイルの存在確認
-            if os.path.exists(font_path):
-                # 高解像度用にフォントサイズを2倍に調整
-                title_font = ImageFont.truetype(font_path, 120)  # 60px → 120px
-                subtitle_font = ImageFont.truetype(font_path, 80)  # 40px → 80px
-                print(f"✅ フォント読み込み成功: {font_path}")
-            else:
-                print(f"❌ フォントファイルが見つかりません: {font_path}")
-                raise FileNotFoundError("Font file not found")
-        except Exception as e:
-            print(f"⚠️ フォント読み込みエラー: {e}")
-            print("フォールバック処理を開始します")
-            
-            # フォールバック1: システムフォントを試行
-            fallback_fonts = [
-                # macOS
-                "/System/Library/Fonts/Arial Unicode.ttc",
-                "/System/Library/Fonts/Hiragino Sans GB.ttc",
-                # Linux (Ubuntu/Streamlit Cloud)
-                "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-                "/usr/share/fonts/truetype/noto/NotoSansCJK-Regular.ttc",
-                "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
-                # Windows
-                "C:\\Windows\\Fonts\\arial.ttf",
-                "C:\\Windows\\Fonts\\meiryo.ttc"
-            ]
-            
-            font_loaded = False
-            for fallback_font in fallback_fonts:
-                try:
-                    if os.path.exists(fallback_font):
-                        title_font = ImageFont.truetype(fallback_font, 120)
-                        subtitle_font = ImageFont.truetype(fallback_font, 80)
-                        print(f"✅ フォールバックフォント使用: {fallback_font}")
-                        font_loaded = True
-                        break
-                except:
-                    continue
+        # 画面の8割を使用する高さ配分計算（余白改善版）
+        total_available_height = int(img_height * 0.75)  # 画面の75%（余白拡大のため）
+        margin_top = int(img_height * 0.15)  # 上余白（画面の15%に拡大）
+        margin_bottom = int(img_height * 0.1)  # 下余白（画面の10%）
+        
+        line_spacing = px(160)
+        text_gap = px(120)  # テキストとイラストの間隔（80px→120px）
+        
+        # テキストの実際の高さを計算
+        text_total_height = len(title_lines) * line_spacing if title_lines else 0
+        
+        # イラストに使用できる高さを計算
+        available_for_illustration = total_available_height - text_total_height - text_gap
+        
+        # テキストを水平方向のみ中央揃えで配置
+        current_y = margin_top
+        for line in title_lines:
+            # 各行を水平方向のみ中央揃え
+            line_width = measure_text_width(title_font, line)
+            line_x = (img_width - line_width) // 2
             
-            # フォールバック2: デフォルトフォント（最後の手段）
-            if not font_loaded:
-                print("⚠️ すべてのフォント読み込みに失敗。デフォルトフォントを使用します")
-                try:
-                    # デフォルトフォントでもサイズ指定を試行
-                    title_font = ImageFont.load_default(size=120)
-                    subtitle_font = ImageFont.load_default(size=80)
-                except:
-                    # 古いPillowバージョンの場合
-                    title_font = ImageFont.load_default()
-                    subtitle_font = ImageFont.load_default()
-        
-        # 画像サイズを取得
-        img_width, img_height = image.size
-        
-        # イラストを決定（指定があればそれを使用、なければランダム）
-        if illustration_image is not None:
-            illustration = illustration_image
-            print("✅ 指定されたイラストを使用")
-        else:
-            illustration = get_random_illustration()
-            print("✅ ランダムイラストを使用")
+            add_line(line, line_x, current_y, title_font, title_font_size, (0, 0, 0, 255))
+            current_y += line_spacing
         
-        # 画像タイプによってレイアウトを決定
-        if image_type == "挿入画像":
-            # 挿入画像レイアウト（テキスト中央揃え）
-            print(f"✅ 挿入画像モード: テキスト中央揃え")
+        # イラストを残りの高さを最大限活用して配置
+        if illustration_size and available_for_illustration > px(200):  # 最小高さ200px確保
+            # イラストの縦横比を保持しながら、利用可能な高さに合わせる
+            aspect_ratio = illustration_size[0] / illustration_size[1]
             
-            # テキスト改行処理（手動指定優先）
-            max_text_width = int(img_width * 0.8)  # 画面の80%幅
+            # 高さを基準にサイズを決定
+            target_height = min(available_for_illustration, int(img_height * 0.6))  # 最大でも画面の60%
+            target_width = int(target_height * aspect_ratio)
             
-            if title_manual_lines:
-                title_lines = title_manual_lines
-                print(f"✅ 挿入画像 手動改行使用: {len(title_lines)}行")
-            else:
-                title_lines = wrap_text(draw, title, title_font, max_text_width) if title else []
-                print(f"✅ 挿入画像 自動改行: {len(title_lines)}行")
+            # 幅が画面幅を超える場合は幅を基準にリサイズ
+            margin_sides = px(200)  # 左右余白
+            if target_width > img_width - margin_sides:
+                target_width = img_width - margin_sides
+                target_height = int(target_width / aspect_ratio)
             
-            # 画面の8割を使用する高さ配分計算（余白改善版）
-            total_available_height = int(img_height * 0.75)  # 画面の75%（余白拡大のため）
-            margin_top = int(img_height * 0.15)  # 上余白（画面の15%に拡大）
-            margin_bottom = int(img_height * 0.1)  # 下余白（画面の10%）
+            # イラストをテキストの下、中央に配置
+            illust_x = (img_width - target_width) // 2
+            illust_y = current_y + text_gap
             
-            line_spacing = 160
-            text_gap = 120  # テキストとイラストの間隔（80px→120px）
+            # 下余白を確保するため、位置を調整
+            if illust_y + target_height > img_height - margin_bottom:
+                illust_y = img_height - margin_bottom - target_height
             
-            # テキストの実際の高さを計算
-            text_total_height = len(title_lines) * line_spacing if title_lines else 0
+            illustration_box = (illust_x, illust_y, target_width, target_height)
             
-            # イラストに使用できる高さを計算
-            available_for_illustration = total_available_height - text_total_height - text_gap
+            # 実際の使用率を計算
+            actual_used_height = (illust_y + target_height) - margin_top
+            usage_ratio = actual_used_height / img_height
             
-            # テキストを水平方向のみ中央揃えで描画
-            current_y = margin_top
+            notes.append(f"✅ 挿入画像 効率配置: テキスト高さ={text_total_height}px, イラスト={target_width}x{target_height}px, 使用率={usage_ratio:.1%}")
+        elif illustration_size:
+            notes.append(f"⚠️ 挿入画像 イラスト省略: 利用可能高さ不足 ({available_for_illustration}px)")
+        
+        subtitle_lines = []  # 挿入画像ではサブタイトルなし
+        
+    elif layout_horizontal:
+        # 横並びレイアウト（アイキャッチ画像）- 改善版
+        # 画面の8割を使用する高さ配分計算
+        total_available_height = int(img_height * 0.8)  # 画面の8割
+        margin_top = int(img_height * 0.1)  # 上余白（画面の10%）
+        margin_bottom = int(img_height * 0.1)  # 下余白（画面の10%）
+        margin_x = px(300)  # 左右余白
+        
+        content_w = img_width - margin_x * 2
+        content_h = total_available_height
+        
+        # イラスト領域（左30%）
+        illust_area_w = int(content_w * 0.30)
+        illust_area_h = content_h
+        illust_area_x = margin_x
+        illust_area_y = margin_top
+        
+        # テキスト領域（右70%）
+        text_area_x = margin_x + illust_area_w
+        text_area_y = margin_top
+        text_area_w = int(content_w * 0.70)
+        text_area_h = content_h
+        text_pad_x = px(120)  # テキスト領域の左余白
+        text_pad_y = px(80)   # テキスト領域の上余白
+        
+        line_spacing = px(160)
+        text_max_width = min(text_area_w - text_pad_x * 2, int(img_width * 0.4))  # テキスト幅調整
+        max_text_width = text_max_width
+        
+        # タイトル改行処理（手動指定優先）
+        if title_manual_lines:
+            title_lines = list(title_manual_lines)
+            notes.append(f"✅ 横並び 手動改行使用: {len(title_lines)}行")
+        else:
+            title_lines = wrap_text(None, title, title_font, text_max_width) if title else []
+            notes.append(f"✅ 横並び 自動改行: {len(title_lines)}行")
+        
+        # テキストの実際の高さを計算
+        text_total_height = len(title_lines) * line_spacing if title_lines else 0
+        if subtitle:
+            subtitle_lines = wrap_text(None, subtitle, subtitle_font, text_max_width)
+            text_total_height += len(subtitle_lines) * px(120) + px(80)  # サブタイトル + 間隔
+        else:
+            subtitle_lines = []
+        
+        # テキストを垂直中央に配置（サブタイトルがない場合）
+        if not subtitle and title_lines:
+            # テキスト領域の垂直中央に配置
+            current_text_y = text_area_y + (text_area_h - text_total_height) // 2
+            notes.append(f"✅ 横並び 垂直中央配置: タイトル行数={len(title_lines)}, 開始Y={current_text_y}")
+        else:
+            current_text_y = text_area_y + text_pad_y
+        
+        # タイトルを配置
+        if title_lines:
             for line in title_lines:
-                # 各行を水平方向のみ中央揃え
-                bbox = draw.textbbox((0, 0), line, font=title_font)
-                line_width = bbox[2] - bbox[0]
-                line_x = (img_width - line_width) // 2
-                
-                draw.text((line_x, current_y), line, font=title_font, fill=(0, 0, 0, 255))
-                current_y += line_spacing
-            
-            # イラストを残りの高さを最大限活用して配置
-            if illustration and available_for_illustration > 200:  # 最小高さ200px確保
-                # イラストの縦横比を保持しながら、利用可能な高さに合わせる
-                aspect_ratio = illustration.width / illustration.height
-                
-                # 高さを基準にサイズを決定
-                target_height = min(available_for_illustration, int(img_height * 0.6))  # 最大でも画面の60%
-                target_width = int(target_height * aspect_ratio)
-                
-                # 幅が画面幅を超える場合は幅を基準にリサイズ
-                margin_sides = 200  # 左右余白
-                if target_width > img_width - margin_sides:
-                    target_width = img_width - margin_sides
-                    target_height = int(target_width / aspect_ratio)
-                
-                illustration_resized = illustration.resize((target_width, target_height), Image.Resampling.LANCZOS)
-                
-                # イラストをテキストの下、中央に配置
-                illust_x = (img_width - target_width) // 2
-                illust_y = current_y + text_gap
-                
-                # 下余白を確保するため、位置を調整
-                if illust_y + target_height > img_height - margin_bottom:
-                    illust_y = img_height - margin_bottom - target_height
-                
-                if illustration_resized.mode != 'RGBA':
-                    illustration_resized = illustration_resized.convert('RGBA')
-                image.paste(illustration_resized, (illust_x, illust_y), illustration_resized)
-                
-                # 実際の使用率を計算
-                actual_used_height = (illust_y + target_height) - margin_top
-                usage_ratio = actual_used_height / img_height
-                
-                print(f"✅ 挿入画像 効率配置: テキスト高さ={text_total_height}px, イラスト={target_width}x{target_height}px, 使用率={usage_ratio:.1%}")
-            else:
-                print(f"⚠️ 挿入画像 イラスト省略: 利用可能高さ不足 ({available_for_illustration}px)")
-            
-            subtitle_lines = []  # 挿入画像ではサブタイトルなし
-            
-        elif layout_horizontal:
-            # 横並びレイアウト（アイキャッチ画像）- 改善版
-            # 画面の8割を使用する高さ配分計算
-            total_available_height = int(img_height * 0.8)  # 画面の8割
-            margin_top = int(img_height * 0.1)  # 上余白（画面の10%）
-            margin_bottom = int(img_height * 0.1)  # 下余白（画面の10%）
-            margin_x = 300  # 左右余白
-            
-            content_w = img_width - margin_x * 2
-            content_h = total_available_height
-            
-            # イラスト領域（左30%）
-            illust_area_w = int(content_w * 0.30)
-            illust_area_h = content_h
-            illust_area_x = margin_x
-            illust_area_y = margin_top
-            
-            # テキスト領域（右70%）
-            text_area_x = margin_x + illust_area_w
-            text_area_y = margin_top
-            text_area_w = int(content_w * 0.70)
-            text_area_h = content_h
-            text_pad_x = 120  # テキスト領域の左余白
-            text_pad_y = 80   # テキスト領域の上余白
-            
-            line_spacing = 160
+                add_line(line, text_area_x + text_pad_x, current_text_y, title_font, title_font_size, (0, 0, 0, 255))
+                current_text_y += line_spacing
+            current_text_y += px(80)  # タイトル・サブタイトル間の余白
+        
+        # サブタイトルを配置
+        if subtitle_lines:
+            for line in subtitle_lines:
+                add_line(line, text_area_x + text_pad_x, current_text_y, subtitle_font, subtitle_font_size, (100, 100, 100, 255))
+                current_text_y += px(120)
+        
+        # イラストをテキスト量に応じて動的にサイズ調整
+        if illustration_size:
+            # テキスト量に応じてイラストサイズを決定
+            text_usage_ratio = text_total_height / content_h
             
-            # タイトル改行処理（手動指定優先）
-            if title_manual_lines:
-                title_lines = title_manual_lines
-                print(f"✅ 横並び 手動改行使用: {len(title_lines)}行")
-            else:
-                text_max_width = min(text_area_w - text_pad_x * 2, int(img_width * 0.4))  # テキスト幅調整
-                title_lines = wrap_text(draw, title, title_font, text_max_width) if title else []
-                print(f"✅ 横並び 自動改行: {len(title_lines)}行")
+            if text_usage_ratio < 0.3:  # テキストが少ない場合
+                illust_scale = 0.95  # イラストを大きく
+            elif text_usage_ratio < 0.6:  # テキストが中程度
+                illust_scale = 0.85  # 標準サイズ
+            else:  # テキストが多い場合
+                illust_scale = 0.75  # イラストを小さく
             
-            # テキストの実際の高さを計算
-            text_total_height = len(title_lines) * line_spacing if title_lines else 0
-            if subtitle:
-                subtitle_lines = wrap_text(draw, subtitle, subtitle_font, text_max_width)
-                text_total_height += len(subtitle_lines) * 120 + 80  # サブタイトル + 間隔
-            else:
-                subtitle_lines = []
+            illust_ratio = min(illust_area_w / illustration_size[0], illust_area_h / illustration_size[1]) * illust_scale
+            new_w = int(illustration_size[0] * illust_ratio)
+            new_h = int(illustration_size[1] * illust_ratio)
             
-            # テキストを垂直中央に配置（サブタイトルがない場合）
-            if not subtitle and title_lines:
-                # テキスト領域の垂直中央に配置
-                current_text_y = text_area_y + (text_area_h - text_total_height) // 2
-                print(f"✅ 横並び 垂直中央配置: タイトル行数={len(title_lines)}, 開始Y={current_text_y}")
-            else:
-                current_text_y = text_area_y + text_pad_y
+            # イラストを左側領域の中央に配置
+            paste_x = illust_area_x + (illust_area_w - new_w) // 2
+            paste_y = illust_area_y + (illust_area_h - new_h) // 2
             
-            # タイトルを描画
-            if title_lines:
-                for line in title_lines:
-                    draw.text((text_area_x + text_pad_x, current_text_y), 
-                             line, font=title_font, fill=(0, 0, 0, 255))
-                    current_text_y += line_spacing
-                current_text_y += 80  # タイトル・サブタイトル間の余白
+            illustration_box = (paste_x, paste_y, new_w, new_h)
             
-            # サブタイトルを描画
-            if subtitle_lines:
-                for line in subtitle_lines:
-                    draw.text((text_area_x + text_pad_x, current_text_y), 
-                             line, font=subtitle_font, fill=(100, 100, 100, 255))
-                    current_text_y += 120
-            
-            # イラストをテキスト量に応じて動的にサイズ調整
-            if illustration:
-                # テキスト量に応じてイラストサイズを決定
-                text_usage_ratio = text_total_height / content_h
-                
-                if text_usage_ratio < 0.3:  # テキストが少ない場合
-                    illust_scale = 0.95  # イラストを大きく
-                elif text_usage_ratio < 0.6:  # テキストが中程度
-                    illust_scale = 0.85  # 標準サイズ
-                else:  # テキストが多い場合
-                    illust_scale = 0.75  # イラストを小さく
-                
-                scale = min(illust_area_w / illustration.width, illust_area_h / illustration.height) * illust_scale
-                new_w = int(illustration.width * scale)
-                new_h = int(illustration.height * scale)
-                illustration_resized = illustration.resize((new_w, new_h), Image.Resampling.LANCZOS)
-                
-                # イラストを左側領域の中央に配置
-                paste_x = illust_area_x + (illust_area_w - new_w) // 2
-                paste_y = illust_area_y + (illust_area_h - new_h) // 2
-                
-                if illustration_resized.mode != 'RGBA':
-                    illustration_resized = illustration_resized.convert('RGBA')
-                image.paste(illustration_resized, (paste_x, paste_y), illustration_resized)
-                
-                print(f"✅ 横並び 動的サイズ: イラスト={new_w}x{new_h}, テキスト使用率={text_usage_ratio:.1%}, スケール={illust_scale:.2f}")
-            else:
-                subtitle_lines = []
+            notes.append(f"✅ 横並び 動的サイズ: イラスト={new_w}x{new_h}, テキスト使用率={text_usage_ratio:.1%}, スケール={illust_scale:.2f}")
+        else:
+            subtitle_lines = []
+    
+    else:
+        # 縦並びレイアウト（アイキャッチ画像）- 改善版
+        # 画面の8割を使用する高さ配分計算
+        total_available_height = int(img_height * 0.8)  # 画面の8割
+        margin_top = int(img_height * 0.1)  # 上余白（画面の10%）
+        margin_bottom = int(img_height * 0.1)  # 下余白（画面の10%）
+        margin_left = px(200)  # 左余白
         
+        line_spacing = px(160)
+        text_illustration_gap = px(120)  # テキストとイラストの間隔
+        
+        # テキスト描画可能な最大幅を計算（全体の70%、ロゴ回避）
+        max_text_width = int(img_width * 0.7)
+        
+        # タイトル改行処理（手動指定優先）
+        if title_manual_lines:
+            title_lines = list(title_manual_lines)
+            notes.append(f"✅ 縦並び 手動改行使用: {len(title_lines)}行")
         else:
-            # 縦並びレイアウト（アイキャッチ画像）- 改善版
-            # 画面の8割を使用する高さ配分計算
-            total_available_height = int(img_height * 0.8)  # 画面の8割
-            margin_top = int(img_height * 0.1)  # 上余白（画面の10%）
-            margin_bottom = int(img_height * 0.1)  # 下余白（画面の10%）
-            margin_left = 200  # 左余白
-            
-            line_spacing = 160
-            text_illustration_gap = 120  # テキストとイラストの間隔
+            title_lines = wrap_text(None, title, title_font, max_text_width) if title else []
+            notes.append(f"✅ 縦並び 自動改行: {len(title_lines)}行")
+        
+        # テキストの実際の高さを計算
+        text_total_height = len(title_lines) * line_spacing if title_lines else 0
+        if subtitle:
+            subtitle_lines = wrap_text(None, subtitle, subtitle_font, max_text_width)
+            text_total_height += len(subtitle_lines) * px(120) + px(240)  # サブタイトル + 間隔
+        else:
+            subtitle_lines = []
+        
+        # イラストに使用できる高さを計算
+        available_for_illustration = total_available_height - text_total_height - text_illustration_gap
+        
+        # タイトルを配置
+        current_y = margin_top
+        if title_lines:
+            for line in title_lines:
+                add_line(line, margin_left, current_y, title_font, title_font_size, (0, 0, 0, 255))
+                current_y += line_spacing
+            current_y += px(240)  # タイトル・サブタイトル間の余白
+        
+        # サブタイトルを配置
+        if subtitle_lines:
+            for line in subtitle_lines:
+                add_line(line, margin_left, current_y, subtitle_font, subtitle_font_size, (100, 100, 100, 255))
+                current_y += px(120)
+        
+        # イラストを残りの高さを最大限活用して配置
+        if illustration_size and available_for_illustration > px(200):  # 最小高さ200px確保
+            # イラストの縦横比を保持しながら、利用可能な高さに合わせる
+            aspect_ratio = illustration_size[0] / illustration_size[1]
             
-            # テキスト描画可能な最大幅を計算（全体の70%、ロゴ回避）
-            max_text_width = int(img_width * 0.7)
+            # 高さを基準にサイズを決定
+            target_height = min(available_for_illustration, int(img_height * 0.5))  # 最大でも画面の50%
+            target_width = int(target_height * aspect_ratio)
             
-            # タイトル改行処理（手動指定優先）
-            if title_manual_lines:
-                title_lines = title_manual_lines
-                print(f"✅ 縦並び 手動改行使用: {len(title_lines)}行")
-            else:
-                title_lines = wrap_text(draw, title, title_font, max_text_width) if title else []
-                print(f"✅ 縦並び 自動改行: {len(title_lines)}行")
+            # 幅が画面幅を超える場合は幅を基準にリサイズ
+            margin_sides = px(300)
+            if target_width > img_width - margin_sides:
+                target_width = img_width - margin_sides
+                target_height = int(target_width / aspect_ratio)
             
-            # テキストの実際の高さを計算
-            text_total_height = len(title_lines) * line_spacing if title_lines else 0
-            if subtitle:
-                subtitle_lines = wrap_text(draw, subtitle, subtitle_font, max_text_width)
-                text_total_height += len(subtitle_lines) * 120 + 240  # サブタイトル + 間隔
-            else:
-                subtitle_lines = []
+            # イラストをテキストの下、中央に配置
+            illustration_x = (img_width - target_width) // 2
+            illustration_y = current_y + text_illustration_gap
             
-            # イラストに使用できる高さを計算
-            available_for_illustration = total_available_height - text_total_height - text_illustration_gap
+            # 下余白を確保するため、位置を調整
+            if illustration_y + target_height > img_height - margin_bottom:
+                illustration_y = img_height - margin_bottom - target_height
             
-            # タイトルを描画
-            current_y = margin_top
-            if title_lines:
-                for line in title_lines:
-                    draw.text((margin_left, current_y), line, font=title_font, fill=(0, 0, 0, 255))
-                    current_y += line_spacing
-                current_y += 240  # タイトル・サブタイトル間の余白
+            illustration_box = (illustration_x, illustration_y, target_width, target_height)
             
-            # サブタイトルを描画
-            if subtitle_lines:
-                for line in subtitle_lines:
-                    draw.text((margin_left, current_y), line, font=subtitle_font, fill=(100, 100, 100, 255))
-                    current_y += 120
+            # 実際の使用率を計算
+            actual_used_height = (illustration_y + target_height) - margin_top
+            usage_ratio = actual_used_height / img_height
             
-            # イラストを残りの高さを最大限活用して配置
-            if illustration and available_for_illustration > 200:  # 最小高さ200px確保
-                # イラストの縦横比を保持しながら、利用可能な高さに合わせる
-                aspect_ratio = illustration.width / illustration.height
-                
-                # 高さを基準にサイズを決定
-                target_height = min(available_for_illustration, int(img_height * 0.5))  # 最大でも画面の50%
-                target_width = int(target_height * aspect_ratio)
-                
-                # 幅が画面幅を超える場合は幅を基準にリサイズ
-                margin_sides = 300
-                if target_width > img_width - margin_sides:
-                    target_width = img_width - margin_sides
-                    target_height = int(target_width / aspect_ratio)
-                
-                illustration_resized = illustration.resize((target_width, target_height), Image.Resampling.LANCZOS)
-                
-                # イラストをテキストの下、中央に配置
-                illustration_x = (img_width - target_width) // 2
-                illustration_y = current_y + text_illustration_gap
-                
-                # 下余白を確保するため、位置を調整
-                if illustration_y + target_height > img_height - margin_bottom:
-                    illustration_y = img_height - margin_bottom - target_height
-                
-                if illustration_resized.mode != 'RGBA':
-                    illustration_resized = illustration_resized.convert('RGBA')
-                image.paste(illustration_resized, (illustration_x, illustration_y), illustration_resized)
-                
-                # 実際の使用率を計算
-                actual_used_height = (illustration_y + target_height) - margin_top
-                usage_ratio = actual_used_height / img_height
-                
-                print(f"✅ 縦並び 効率配置: テキスト高さ={text_total_height}px, イラスト={target_width}x{target_height}px, 使用率={usage_ratio:.1%}")
-            else:
-                print(f"⚠️ 縦並び イラスト省略: 利用可能高さ不足 ({available_for_illustration}px)")
+            notes.append(f"✅ 縦並び 効率配置: テキスト高さ={text_total_height}px, イラスト={target_width}x{target_height}px, 使用率={usage_ratio:.1%}")
+        elif illustration_size:
+            notes.append(f"⚠️ 縦並び イラスト省略: 利用可能高さ不足 ({available_for_illustration}px)")
+    
+    # はみ出し判定（幅: 最大幅を超える行、高さ: 下余白に食い込むテキスト）
+    # 高さは送り済みのペン位置ではなく、最後に描く文字の下端で判定する
+    text_bottom = max(
+        (box['y'] + get_font(box['font_size'], font_path).getbbox(box['text'])[3] for box in text_boxes),
+        default=0
+    )
+    overflow = {
+        'text_width': any(box['width'] > max_text_width for box in text_boxes),
+        'text_height': text_bottom > img_height - margin_bottom,
+        'illustration_omitted': bool(illustration_size) and illustration_box is None
+    }
+    
+    return {
+        'canvas_size': canvas_size,
+        'image_type': image_type,
+        'layout_horizontal': layout_horizontal,
+        'title_lines': title_lines,
+        'subtitle_lines': subtitle_lines if subtitle else [],
+        'text_boxes': text_boxes,
+        'illustration_box': illustration_box,
+        'overflow': overflow,
+        'notes': notes
+    }
+
+def clear_render_caches():
+    """文字幅・グリフ・レイアウト・リサイズ済みイラスト・合成済みキャンバス・描画結果のキャッシュを空にする（ベンチマーク用）"""
+    global _resized_illustrations_bytes, _composited_canvases_bytes, _glyph_masks_bytes, _render_results_bytes
+
+    with _text_metrics_lock:
+        _glyph_metrics.clear()
+        _kerning_pairs.clear()
+        _line_widths.clear()
+    with _glyph_masks_lock:
+        _glyph_masks.clear()
+        _glyph_masks_bytes = 0
+    _plan_layout_cached.cache_clear()
+    with _resized_illustrations_lock:
+        _resized_illustrations.clear()
+        _resized_illustrations_bytes = 0
+    with _composited_canvases_lock:
+        _composited_canvases.clear()
+        _composited_canvases_bytes = 0
+    with _render_results_lock:
+        _render_results.clear()
+        _render_results_bytes = 0
+
+# 背景にイラストを合成済みのキャンバスのキャッシュ（テンプレート・イラスト・配置単位）
+COMPOSITED_CANVAS_CACHE_BYTES = int(os.getenv('COMPOSITED_CANVAS_CACHE_BYTES', str(256 * 1024 * 1024)))
+_composited_canvases = OrderedDict()
+_composited_canvases_bytes = 0
+_composited_canvases_lock = threading.Lock()
+
+def _compose_base_canvas(template_image, illustration, illustration_box, illustration_id=None):
+    """テンプレートをRGBAでコピーし、イラストを配置したキャンバスを返す"""
+    with timed("copy"):
+        image = template_image.copy() if template_image.mode == "RGBA" else template_image.convert("RGBA")
+
+    if illustration is not None and illustration_box is not None:
+        x, y, width, height = illustration_box
+        illustration_resized = resize_illustration(illustration, (width, height), illustration_id)
+        with timed("composite"):
+            image.paste(illustration_resized, (x, y), illustration_resized)
+
+    return image
+
+def get_base_canvas(template_image, template_id, illustration, illustration_id, illustration_box):
+    """背景＋イラストの合成済みキャンバスを返す（同じ組み合わせは使い回す）
+
+    イラストの位置はレイアウトと行数だけで決まるため、キーは
+    (テンプレート, イラスト, テンプレートサイズ, 配置) とする。
+    返す画像はキャッシュと共有されるため、呼び出し側で copy() してから使うこと。
+    """
+    global _composited_canvases_bytes
+
+    key = (_frame_cache_id(template_id), _frame_cache_id(illustration_id), template_image.size, illustration_box)
+    with _composited_canvases_lock:
+        canvas = _composited_canvases.get(key)
+        if canvas is not None:
+            _composited_canvases.move_to_end(key)
+            increment("composited_canvas_hit")
+            return canvas
+
+    canvas = _compose_base_canvas(template_image, illustration, illustration_box, illustration_id)
+
+    with _composited_canvases_lock:
+        if key not in _composited_canvases:
+            _composited_canvases[key] = canvas
+            _composited_canvases_bytes += canvas.width * canvas.height * 4
+            # 上限を超えたら古いものから削除
+            while _composited_canvases_bytes > COMPOSITED_CANVAS_CACHE_BYTES and len(_composited_canvases) > 1:
+                _, evicted = _composited_canvases.popitem(last=False)
+                _composited_canvases_bytes -= evicted.width * evicted.height * 4
+    return canvas
+
+def rasterize_layout(template_image, plan, illustration=None, illustration_id=None, template_id=None):
+    """計算済みのレイアウトに従ってテキストとイラストを描画した画像を返す
+
+    template_id と illustration_id があれば、背景＋イラストの合成結果を
+    キャッシュから取り出し、コピーしてテキストを描くだけで済ませる。
+    """
+    illustration_box = plan['illustration_box'] if illustration is not None else None
+    if template_id is not None and illustration_id is not None and illustration_box is not None:
+        base = get_base_canvas(template_image, template_id, illustration, illustration_id, illustration_box)
+        with timed("copy"):
+            image = base.copy()
+    else:
+        image = _compose_base_canvas(template_image, illustration, illustration_box, illustration_id)
+    draw = ImageDraw.Draw(image)
+    
+    # テキストを描画（フォントとグリフはプロセス内で共有、イラストとは重ならない位置に配置済み）
+    with timed("draw"):
+        for box in plan['text_boxes']:
+            draw_text(image, draw, (box['x'], box['y']), box['text'], get_font(box['font_size']), box['fill'])
+    
+    return image
+
+def create_image_with_text(template_image, title, subtitle="", layout_horizontal=False, illustration_image=None, title_manual_lines=None, image_type="アイキャッチ画像", illustration_id=None, scale=2, template_id=None):
+    """テンプレート画像にテキストとイラストを追加して新しい画像を生成
+
+    illustration_id（イラストのフレームID）を渡すとリサイズ結果がキャッシュされる。
+    template_id も渡すと背景＋イラストの合成結果もキャッシュされる。
+    scale は素材の書き出し倍率（1 = プレビュー用、2 = 高解像度）。
+    illustration_id を指定してイラスト画像がない場合は、別のイラストで
+    代用せず None を返す（描画結果のキャッシュに違う画像が入らないように）。
+    """
+    if template_image is None:
+        return None
+        
+    try:
+        # イラストを決定（指定があればそれを使用、指定がなければランダム）
+        if illustration_image is not None:
+            illustration = illustration_image
+            logger.debug("指定されたイラストを使用")
+        elif illustration_id is not None:
+            logger.error("指定されたイラストを取得できません: %s", illustration_id)
+            return None
+        else:
+            illustration = get_random_illustration(scale)
+            illustration_id = None
+            logger.debug("ランダムイラストを使用")
+        
+        # レイアウトを計算してから描画（フォントは scale=2 で120px/80px）
+        with timed("layout"):
+            plan = plan_layout(
+                template_image.size,
+                title,
+                subtitle,
+                layout_horizontal,
+                illustration.size if illustration else None,
+                title_manual_lines,
+                image_type,
+                scale=scale
+            )
+        if logger.isEnabledFor(logging.DEBUG):
+            for note in plan['notes']:
+                logger.debug(note)
+        
+        image = rasterize_layout(template_image, plan, illustration, illustration_id, template_id)
             
         # 使用された改行結果を返すために辞書形式で返す
         result = {
             'image': image,
-            'title_lines': title_lines if 'title_lines' in locals() else [],
-            'subtitle_lines': subtitle_lines if subtitle and 'subtitle_lines' in locals() else []
+            'title_lines': list(plan['title_lines']),
+            'subtitle_lines': list(plan['subtitle_lines']),
+            'layout': plan
         }
         return result
         
     except Exception as e:
-        print(f"画像生成エラー: {e}")
+        logger.error("画像生成エラー: %s", e)
         return None
- 
\ No newline at end of file
+
+# 出力形式（拡張子・MIMEタイプ）
+OUTPUT_FORMATS = {
+    'png': {'label': 'PNG', 'extension': 'png', 'mime': 'image/png'},
+    'png8': {'label': 'PNG（減色・256色）', 'extension': 'png', 'mime': 'image/png'},
+    'webp': {'label': 'WebP（非可逆）', 'extension': 'webp', 'mime': 'image/webp'},
+    'webp_lossless': {'label': 'WebP（可逆）', 'extension': 'webp', 'mime': 'image/webp'},
+    'jpeg': {'label': 'JPEG', 'extension': 'jpg', 'mime': 'image/jpeg'}
+}
+
+def encode_image(image, output_format="png", quality=90, compress_level=6, colors=256):
+    """画像を指定形式でエンコードしてバイト列を返す
+
+    - png: compress_level（0-9）で圧縮率と速度を調整
+    - png8: 色数を colors に減色してから保存（フラットな配色のテンプレート向け）
+    - webp / webp_lossless: 非可逆（quality指定）または可逆のWebP
+    - jpeg: 透過部分を白で合成して quality 指定で保存
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"未対応の出力形式です: {output_format}")
+
+    with timed("encode"):
+        buffer = BytesIO()
+        if output_format == "png":
+            image.save(buffer, format='PNG', compress_level=compress_level)
+        elif output_format == "png8":
+            quantized = image.quantize(colors=colors, method=Image.Quantize.FASTOCTREE)
+            quantized.save(buffer, format='PNG', compress_level=compress_level)
+        elif output_format == "webp":
+            image.save(buffer, format='WEBP', quality=quality, method=4)
+        elif output_format == "webp_lossless":
+            image.save(buffer, format='WEBP', lossless=True, quality=quality, method=4)
+        else:
+            if image.mode in ("RGBA", "LA", "P"):
+                rgba = image.convert("RGBA")
+                background = Image.new("RGB", rgba.size, (255, 255, 255))
+                background.paste(rgba, mask=rgba.getchannel("A"))
+                image = background
+            elif image.mode != "RGB":
+                image = image.convert("RGB")
+            image.save(buffer, format='JPEG', quality=quality, optimize=True)
+    return buffer.getvalue()
+
+def output_filename(stem, output_format="png"):
+    """出力形式に合った拡張子のファイル名を返す"""
+    return f"{stem}.{OUTPUT_FORMATS[output_format]['extension']}"
+
+# 素材の固定選択と描画結果のキャッシュ
+# 描画結果が変わる変更（レイアウト・文字描画など）を入れたら上げる
+RENDERER_VERSION = "1"
+DETERMINISTIC_RENDER = os.getenv('DETERMINISTIC_RENDER', '0') == '1'
+RENDER_SEED = int(os.getenv('RENDER_SEED', '0'))
+RENDER_RESULT_CACHE_BYTES = int(os.getenv('RENDER_RESULT_CACHE_BYTES', str(128 * 1024 * 1024)))
+_render_results = OrderedDict()
+_render_results_bytes = 0
+_render_results_lock = threading.Lock()
+
+def pick_asset(frames, seed=None, *parts):
+    """素材を1つ選ぶ（seed があれば seed と parts から決まった素材を返す）
+
+    seed が None の場合は random.choice と同じ。seed を指定すると、
+    同じ見出し（parts）には素材一覧の並び順によらず常に同じ素材を返す。
+    """
+    if not frames:
+        return None
+    if seed is None:
+        return random.choice(frames)
+
+    ordered = sorted(frames, key=lambda frame: frame['id'])
+    digest = hashlib.sha256("\0".join(str(part) for part in (seed,) + parts).encode('utf-8')).digest()
+    return ordered[int.from_bytes(digest[:8], 'big') % len(ordered)]
+
+def _font_version():
+    """キャッシュのキーに使うフォントの版（ファイル名・サイズ・更新時刻）"""
+    if RESOLVED_FONT_PATH is None:
+        return "default"
+    try:
+        stat = os.stat(RESOLVED_FONT_PATH)
+    except OSError:
+        return os.path.basename(RESOLVED_FONT_PATH)
+    return f"{os.path.basename(RESOLVED_FONT_PATH)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+def render_cache_key(template_id, illustration_id, render_kwargs, scale=2, output_format="png", encoder_options=None):
+    """描画結果のキャッシュキー（入力内容のハッシュ）を返す
+
+    見出しの文字・種類・レイアウト・改行、素材のIDと版、フォント、
+    描画処理の版、倍率と出力形式が同じなら同じキーになる。
+    """
+    payload = {
+        'renderer': RENDERER_VERSION,
+        'font': _font_version(),
+        'template': _frame_cache_id(template_id),
+        'illustration': _frame_cache_id(illustration_id) if illustration_id else None,
+        'title': render_kwargs.get('title', ""),
+        'subtitle': render_kwargs.get('subtitle', ""),
+        'layout_horizontal': bool(render_kwargs.get('layout_horizontal', False)),
+        'title_manual_lines': list(render_kwargs.get('title_manual_lines') or []),
+        'image_type': render_kwargs.get('image_type', "アイキャッチ画像"),
+        'scale': scale,
+        'output_format': output_format,
+        'encoder_options': dict(sorted((encoder_options or {}).items()))
+    }
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+def get_cached_render(key):
+    """キャッシュ済みの描画結果 {'encoded', 'title_lines'} を返す（なければ None）"""
+    with _render_results_lock:
+        cached = _render_results.get(key)
+        if cached is not None:
+            _render_results.move_to_end(key)
+    increment("render_cache_hit" if cached is not None else "render_cache_miss")
+    return cached
+
+def store_cached_render(key, encoded, title_lines=None):
+    """エンコード済みの描画結果をキャッシュに保存"""
+    global _render_results_bytes
+
+    with _render_results_lock:
+        previous = _render_results.pop(key, None)
+        if previous is not None:
+            _render_results_bytes -= len(previous['encoded'])
+        _render_results[key] = {'encoded': encoded, 'title_lines': list(title_lines or [])}
+        _render_results_bytes += len(encoded)
+        # 上限を超えたら古いものから削除
+        while _render_results_bytes > RENDER_RESULT_CACHE_BYTES and len(_render_results) > 1:
+            _, evicted = _render_results.popitem(last=False)
+            _render_results_bytes -= len(evicted['encoded'])
+
+# 素材の先読み状況（プロセスで1度だけ実行）
+_warmup_status = {'state': 'idle', 'total': 0, 'completed': 0, 'failed': 0, 'elapsed_seconds': 0.0}
+_warmup_lock = threading.Lock()
+
+def _update_warmup_status(**changes):
+    with _warmup_lock:
+        _warmup_status.update(changes)
+
+def _warmup_frame(provider, frame_id, handle, scale, fmt):
+    """1フレームを取得してデコード済みプールに載せる"""
+    content = provider.load_bytes(frame_id, scale, fmt, handle)
+    if content is None:
+        return False
+    return get_decoded_frame(frame_id, scale, fmt, content=content) is not None
+
+def warm_up_assets(scales=None, fmt="png", max_workers=None):
+    """素材一覧の全フレームを取得・デコードしておく（再起動直後の初回生成を速くする）
+
+    進捗は asset_warmup_status() で確認できる。倍率ごとに画像URLをまとめて解決し、
+    取得とデコードは max_workers 並列で行う。
+    """
+    if scales is None:
+        scales = ASSET_WARMUP_SCALES
+    if max_workers is None:
+        max_workers = ASSET_WARMUP_WORKERS
+    max_workers = max(1, max_workers)
+
+    start = time.perf_counter()
+    _update_warmup_status(state='running', total=0, completed=0, failed=0, elapsed_seconds=0.0)
+
+    manifest = get_asset_manifest()
+    if manifest is None:
+        _update_warmup_status(state='failed', elapsed_seconds=time.perf_counter() - start)
+        logger.warning("素材の先読みに失敗しました（アセット一覧を取得できません）")
+        return asset_warmup_status()
+
+    frame_ids = list(dict.fromkeys(frame['id'] for frame in manifest['background'] + manifest['illustration']))
+    _update_warmup_status(total=len(frame_ids) * len(scales))
+
+    provider = get_asset_provider()
+    # 書き込みごとのキャッシュ走査を避け、削除は全フレームを書いた後に1度だけ行う
+    with defer_asset_cache_eviction(), ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for scale in scales:
+            handles = provider.resolve(frame_ids, scale, fmt)
+            futures = [executor.submit(_warmup_frame, provider, frame_id, handles.get(frame_id), scale, fmt) for frame_id in frame_ids]
+            for future in as_completed(futures):
+                try:
+                    ok = future.result()
+                except Exception as e:
+                    logger.error("素材の先読みエラー: %s", e)
+                    ok = False
+                with _warmup_lock:
+                    _warmup_status['completed'] += 1
+                    if not ok:
+                        _warmup_status['failed'] += 1
+
+    elapsed = time.perf_counter() - start
+    _update_warmup_status(state='ready', elapsed_seconds=elapsed)
+    status = asset_warmup_status()
+    logger.info("素材の先読みが完了しました（%d件, 失敗 %d件, %.1f秒）", status['total'], status['failed'], elapsed)
+    return status
+
+def start_asset_warmup(scales=None, fmt="png", max_workers=None):
+    """素材の先読みをバックグラウンドで開始（プロセスで1度だけ、開始したらTrue）"""
+    with _warmup_lock:
+        if _warmup_status['state'] != 'idle':
+            return False
+        _warmup_status['state'] = 'running'
+
+    threading.Thread(
+        target=warm_up_assets,
+        args=(scales, fmt, max_workers),
+        name="asset-warmup",
+        daemon=True
+    ).start()
+    return True
+
+def asset_warmup_status():
+    """先読みの状況を返す（state: idle / running / ready / failed）"""
+    with _warmup_lock:
+        return dict(_warmup_status)
+
+def _render_pipeline_job(job, template_future, illustration_future, scale=2, fmt="png"):
+    """素材のダウンロード完了を待って1枚分を描画"""
+    outcome = {
+        'index': job['index'],
+        'template_image': None,
+        'illustration_image': None,
+        'result': None,
+        'error': None
+    }
+
+    try:
+        template_bytes = template_future.result()
+    except Exception as e:
+        logger.error("高解像度画像取得エラー: %s", e)
+        template_bytes = None
+
+    if template_bytes is None:
+        outcome['error'] = 'template'
+        return outcome
+
+    try:
+        illustration_bytes = illustration_future.result() if illustration_future else None
+    except Exception as e:
+        logger.error("高解像度イラスト画像取得エラー: %s", e)
+        illustration_bytes = None
+
+    # 指定したイラストが取れなければ別のイラストで代用せずエラーにする
+    if job.get('illustration_id') and illustration_bytes is None:
+        outcome['error'] = 'illustration'
+        return outcome
+
+    try:
+        # テンプレートはデコード済みプールから取得（描画側でコピーして使う）
+        outcome['template_image'] = get_decoded_frame(job['template_id'], scale, fmt, content=template_bytes)
+        # イラストもデコード済みプールから取得（読み込み済みRGBAなのでスレッド間で共有できる）
+        if illustration_bytes is not None:
+            outcome['illustration_image'] = get_decoded_frame(job['illustration_id'], scale, fmt, content=illustration_bytes)
+
+        outcome['result'] = create_image_with_text(
+            template_image=outcome['template_image'],
+            illustration_image=outcome['illustration_image'],
+            scale=scale,
+            illustration_id=job.get('illustration_id'),
+            template_id=job['template_id'],
+            **job['render_kwargs']
+        )
+        if not outcome['result'] or not outcome['result'].get('image'):
+            outcome['error'] = 'render'
+
+    except Exception as e:
+        logger.error("パイプライン処理エラー (画像%d): %s", job['index'] + 1, e)
+        outcome['error'] = 'render'
+
+    return outcome
+
+def iter_render_pipeline(jobs, scale=2, fmt="png", max_workers=None):
+    """複数見出しの素材取得と描画を並行実行し、完了したものから結果を返す
+
+    jobs は {'template_id', 'illustration_id', 'render_kwargs'} の辞書のリスト。
+    画像URLなどはまとめて1回で解決し、同じフレームのダウンロードは1度だけ行う。
+    ダウンロードと描画はそれぞれ max_workers 並列で重ねて実行される。
+    戻り値は {'index', 'template_image', 'illustration_image', 'result', 'error'} を
+    完了順に返すジェネレータ（error は None / 'template' / 'illustration' / 'render'）。
+    """
+    if max_workers is None:
+        max_workers = PIPELINE_MAX_WORKERS
+    max_workers = max(1, max_workers)
+
+    jobs = [dict(job, index=index) for index, job in enumerate(jobs)]
+    frame_ids = []
+    for job in jobs:
+        frame_ids.append(job['template_id'])
+        if job.get('illustration_id'):
+            frame_ids.append(job['illustration_id'])
+
+    # キャッシュにないフレームの画像URLなどをまとめて解決
+    provider = get_asset_provider()
+    handles = provider.resolve(frame_ids, scale, fmt)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as download_pool, \
+         ThreadPoolExecutor(max_workers=max_workers) as render_pool:
+        # 同じフレームは1つのダウンロードを共有
+        downloads = {
+            frame_id: download_pool.submit(provider.load_bytes, frame_id, scale, fmt, handles.get(frame_id))
+            for frame_id in dict.fromkeys(frame_ids)
+        }
+
+        renders = [
+            render_pool.submit(
+                _render_pipeline_job,
+                job,
+                downloads[job['template_id']],
+                downloads.get(job.get('illustration_id')),
+                scale,
+                fmt
+            )
+            for job in jobs
+        ]
+
+        for future in as_completed(renders):
+            yield future.result()
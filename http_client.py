@@ -0,0 +1,112 @@
+import os
+import time
+import random
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+from metrics import increment
+
+# .envファイルを読み込み
+load_dotenv()
+
+# タイムアウト・リトライ設定（秒）
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '30'))
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '3'))
+HTTP_BACKOFF_BASE = float(os.getenv('HTTP_BACKOFF_BASE', '0.5'))
+HTTP_BACKOFF_MAX = float(os.getenv('HTTP_BACKOFF_MAX', '30'))
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '16'))
+
+# リトライ対象のステータスコード
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_session = None
+_session_lock = threading.Lock()
+
+def create_session(pool_size=None):
+    """Keep-Aliveで接続を使い回すSessionを作成"""
+    if pool_size is None:
+        pool_size = HTTP_POOL_SIZE
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def get_session():
+    """プロセス共通のSessionを返す（api.figma.com とCDNへの接続を共有）"""
+    global _session
+
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_session()
+    return _session
+
+def set_session(session):
+    """共通Sessionを差し替える（スタブサーバーでの検証用）"""
+    global _session
+    _session = session
+
+def _parse_retry_after(value):
+    """Retry-After ヘッダー（秒数またはHTTP日付）を待ち秒数に変換"""
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def _backoff_delay(attempt, retry_after=None):
+    """次のリトライまでの待ち時間（指数バックオフ＋フルジッター、Retry-After優先）"""
+    if retry_after is not None:
+        return min(retry_after, HTTP_BACKOFF_MAX)
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+
+def http_get(url, headers=None, timeout=None, max_retries=None):
+    """タイムアウトとリトライ付きでGETする
+
+    接続エラー・タイムアウト・429/5xx の場合は最大 max_retries 回まで再試行する。
+    再試行しても成功しなければ最後のレスポンスを返す（例外の場合は送出する）。
+    """
+    if timeout is None:
+        timeout = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+    if max_retries is None:
+        max_retries = HTTP_MAX_RETRIES
+
+    session = get_session()
+    attempt = 0
+    while True:
+        try:
+            response = session.get(url, headers=headers, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt >= max_retries:
+                raise
+            increment("http_retry")
+            time.sleep(_backoff_delay(attempt))
+            attempt += 1
+            continue
+
+        if response.status_code not in RETRY_STATUS_CODES or attempt >= max_retries:
+            return response
+
+        retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+        response.close()
+        increment("http_retry")
+        time.sleep(_backoff_delay(attempt, retry_after))
+        attempt += 1
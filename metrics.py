@@ -0,0 +1,172 @@
+import os
+import time
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dotenv import load_dotenv
+
+# .envファイルを読み込み
+load_dotenv()
+
+# 処理段階ごとの時間を集計するヒストグラムの区切り（秒）
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Prometheus形式で公開するポート（未設定なら公開しない）
+METRICS_PORT = os.getenv('METRICS_PORT')
+
+METRIC_PREFIX = "template_image"
+
+_histograms = {}  # stage -> [バケットごとの件数..., +Inf], 合計秒, 件数
+_counters = {}  # event -> 件数
+_lock = threading.Lock()
+_server = None
+
+def observe(stage, seconds):
+    """処理段階の所要時間（秒）を記録"""
+    index = bisect.bisect_left(STAGE_BUCKETS, seconds)
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = [[0] * (len(STAGE_BUCKETS) + 1), 0.0, 0]
+        histogram[0][index] += 1
+        histogram[1] += seconds
+        histogram[2] += 1
+
+def increment(event, amount=1):
+    """イベントの件数を加算（キャッシュヒット・リトライなど）"""
+    with _lock:
+        _counters[event] = _counters.get(event, 0) + amount
+
+class timed:
+    """with ブロックの所要時間を処理段階として記録する
+
+        with timed("encode"):
+            ...
+    """
+
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+def drain():
+    """集計を取り出して空にする（ワーカープロセスから親プロセスへ渡す用）"""
+    with _lock:
+        state = {
+            'histograms': {stage: (list(buckets), total, count) for stage, (buckets, total, count) in _histograms.items()},
+            'counters': dict(_counters)
+        }
+        _histograms.clear()
+        _counters.clear()
+    return state
+
+def merge(state):
+    """drain() で取り出した集計を加算"""
+    with _lock:
+        for stage, (buckets, total, count) in state['histograms'].items():
+            histogram = _histograms.get(stage)
+            if histogram is None:
+                histogram = _histograms[stage] = [[0] * (len(STAGE_BUCKETS) + 1), 0.0, 0]
+            for index, bucket_count in enumerate(buckets):
+                histogram[0][index] += bucket_count
+            histogram[1] += total
+            histogram[2] += count
+        for event, amount in state['counters'].items():
+            _counters[event] = _counters.get(event, 0) + amount
+
+def reset():
+    """集計をすべて消す"""
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+def _bucket_quantile(buckets, count, quantile):
+    """バケットの件数から分位点の上限値を求める（該当バケットの上端）"""
+    target = count * quantile
+    cumulative = 0
+    for bound, bucket_count in zip(STAGE_BUCKETS, buckets):
+        cumulative += bucket_count
+        if cumulative >= target:
+            return bound
+    return float('inf')
+
+def snapshot():
+    """集計結果を辞書で返す（画面表示・ダンプ用）"""
+    with _lock:
+        stages = {}
+        for stage, (buckets, total, count) in _histograms.items():
+            stages[stage] = {
+                'count': count,
+                'sum_seconds': total,
+                'mean_seconds': total / count if count else 0.0,
+                'p50_seconds': _bucket_quantile(buckets, count, 0.5),
+                'p95_seconds': _bucket_quantile(buckets, count, 0.95)
+            }
+        return {'stages': stages, 'counters': dict(_counters)}
+
+def render_prometheus():
+    """集計結果をPrometheusのテキスト形式で返す"""
+    with _lock:
+        histograms = {stage: (list(buckets), total, count) for stage, (buckets, total, count) in _histograms.items()}
+        counters = dict(_counters)
+
+    lines = [
+        f"# HELP {METRIC_PREFIX}_stage_seconds 処理段階ごとの所要時間",
+        f"# TYPE {METRIC_PREFIX}_stage_seconds histogram"
+    ]
+    for stage in sorted(histograms):
+        buckets, total, count = histograms[stage]
+        cumulative = 0
+        for bound, bucket_count in zip(STAGE_BUCKETS, buckets):
+            cumulative += bucket_count
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        lines.append(f'{METRIC_PREFIX}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+        lines.append(f'{METRIC_PREFIX}_stage_seconds_sum{{stage="{stage}"}} {total}')
+        lines.append(f'{METRIC_PREFIX}_stage_seconds_count{{stage="{stage}"}} {count}')
+
+    lines.append(f"# HELP {METRIC_PREFIX}_events_total キャッシュヒット・リトライなどの件数")
+    lines.append(f"# TYPE {METRIC_PREFIX}_events_total counter")
+    for event in sorted(counters):
+        lines.append(f'{METRIC_PREFIX}_events_total{{event="{event}"}} {counters[event]}')
+
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # アクセスログは出さない
+        pass
+
+def start_metrics_server(port=None):
+    """/metrics をPrometheus形式で返すHTTPサーバーを別スレッドで起動（プロセスで1度だけ）"""
+    global _server
+
+    if port is None:
+        port = METRICS_PORT
+    if not port:
+        return None
+
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer(("0.0.0.0", int(port)), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+    return _server
@@ -0,0 +1,338 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+from core import create_image_with_text, encode_image, get_decoded_frame, fetch_frame_image, iter_render_pipeline, render_cache_key, get_cached_render, store_cached_render
+
+# .envファイルを読み込み
+load_dotenv()
+
+# 生成結果の保持上限（セッションごと・プロセス全体）
+RESULT_STORE_SESSION_BYTES = int(os.getenv('RESULT_STORE_SESSION_BYTES', str(64 * 1024 * 1024)))  # 既定64MB
+RESULT_STORE_GLOBAL_BYTES = int(os.getenv('RESULT_STORE_GLOBAL_BYTES', str(512 * 1024 * 1024)))  # 既定512MB
+RESULT_ENTRY_OVERHEAD_BYTES = 1024  # メタデータ分の概算
+
+# 前回の結果を作り直さずに使えるか判定する項目（これらが全て同じなら同じ画像になる）
+REUSE_FIELDS = ('headline_text', 'headline_type', 'use_horizontal', 'scale', 'output_format', 'encoder_options')
+
+class ResultStore:
+    """生成結果をセッションごとに保持するストア
+
+    保持するのはフレームID・見出し情報・エンコード済みバイト列だけで、
+    PIL Imageは必要になった時点で作り直す。上限を超えた場合は
+    セッション内・全体とも最後に使われたのが古い結果のバイト列から
+    破棄する（破棄したバイト列は再描画で復元できる）。
+    結果ごとの最終利用順は entry['last_used'] に記録する。
+    """
+
+    def __init__(self, session_budget=None, global_budget=None):
+        self.session_budget = RESULT_STORE_SESSION_BYTES if session_budget is None else session_budget
+        self.global_budget = RESULT_STORE_GLOBAL_BYTES if global_budget is None else global_budget
+        self._sessions = OrderedDict()  # session_id -> 結果のリスト（最後に使われた順）
+        self._lock = threading.Lock()
+        self._clock = 0  # 結果の最終利用順を決める通し番号
+        self.evictions = 0
+
+    @staticmethod
+    def _entry_size(entry):
+        size = RESULT_ENTRY_OVERHEAD_BYTES
+        for key in ('encoded', 'final_encoded'):
+            if entry.get(key):
+                size += len(entry[key])
+        return size
+
+    def _drop_bytes(self, entry):
+        """結果のバイト列（プレビュー・高解像度）を破棄し、解放したサイズを返す"""
+        freed = 0
+        for key in ('final_encoded', 'encoded'):
+            if entry.get(key):
+                freed += len(entry[key])
+                entry[key] = None
+        if freed:
+            self.evictions += 1
+        return freed
+
+    def _touch(self, entry):
+        """結果を最後に使われたものとして記録（呼び出し側でロック済み）"""
+        self._clock += 1
+        entry['last_used'] = self._clock
+
+    @staticmethod
+    def _least_recent_first(entries):
+        return sorted(entries, key=lambda entry: entry.get('last_used', 0))
+
+    def _session_size(self, entries):
+        return sum(self._entry_size(entry) for entry in entries)
+
+    def _enforce_budgets(self, session_id, keep=None):
+        """上限を超えていればバイト列を破棄（呼び出し側でロック済み）
+
+        keep（いま保存した結果）と、セッション内で最後に使われた1件は破棄しない。
+        """
+        entries = self._sessions.get(session_id, [])
+
+        # セッション内は最後に使われたのが古い結果から
+        size = self._session_size(entries)
+        for entry in self._least_recent_first(entries)[:-1]:
+            if size <= self.session_budget:
+                break
+            if entry is keep:
+                continue
+            size -= self._drop_bytes(entry)
+
+        # 全体では他のセッションの、最後に使われたのが古い結果のバイト列から
+        total = sum(self._session_size(session) for session in self._sessions.values())
+        others = [entry for other_id, other_entries in self._sessions.items() if other_id != session_id for entry in other_entries]
+        for entry in self._least_recent_first(others):
+            if total <= self.global_budget:
+                break
+            total -= self._drop_bytes(entry)
+
+        # それでも超える場合はセッションごと削除
+        for other_id in list(self._sessions.keys()):
+            if total <= self.global_budget:
+                break
+            if other_id == session_id:
+                continue
+            total -= self._session_size(self._sessions.pop(other_id))
+
+    def put(self, session_id, entries):
+        """セッションの結果一覧を置き換える"""
+        with self._lock:
+            # 引き継いだ結果は利用順を保ち、新しい結果は最後に使われたものとする
+            for entry in entries:
+                if 'last_used' not in entry:
+                    self._touch(entry)
+            self._sessions[session_id] = list(entries)
+            self._sessions.move_to_end(session_id)
+            self._enforce_budgets(session_id)
+
+    def get(self, session_id):
+        """セッションの結果一覧を返す（なければ空リスト）"""
+        with self._lock:
+            if session_id not in self._sessions:
+                return []
+            self._sessions.move_to_end(session_id)
+            return list(self._sessions[session_id])
+
+    def clear(self, session_id):
+        """セッションの結果を削除"""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def get_encoded(self, session_id, entry):
+        """エンコード済みバイト列を返す（破棄されていれば再描画して復元）"""
+        with self._lock:
+            encoded = entry.get('encoded')
+            if encoded:
+                self._touch(entry)
+                return encoded
+
+        cached = get_cached_render(entry_cache_key(entry))
+        if cached is not None:
+            return self._store_encoded(session_id, entry, 'encoded', cached['encoded'])
+
+        image = render_entry_image(entry)
+        if image is None:
+            return None
+        return self._store_bytes(session_id, entry, 'encoded', image)
+
+    def get_final_encoded(self, session_id, entry):
+        """高解像度（scale=2）のバイト列を返す（プレビューのみの場合はここで描画）"""
+        if entry.get('scale', 2) == 2:
+            return self.get_encoded(session_id, entry)
+        with self._lock:
+            final_encoded = entry.get('final_encoded')
+            if final_encoded:
+                self._touch(entry)
+                return final_encoded
+
+        cached = get_cached_render(entry_cache_key(entry, scale=2))
+        if cached is not None:
+            return self._store_encoded(session_id, entry, 'final_encoded', cached['encoded'])
+
+        image = render_entry_image(entry, scale=2)
+        if image is None:
+            return None
+        return self._store_bytes(session_id, entry, 'final_encoded', image)
+
+    def finalize(self, session_id, entries, on_progress=None):
+        """プレビューのみの結果をまとめて高解像度で描画（素材取得と描画は並行実行）
+
+        on_progress(完了数, 総数) で進捗を通知する。失敗した件数を返す。
+        """
+        pending = [entry for entry in entries if entry.get('scale', 2) != 2 and not entry.get('final_encoded')]
+
+        # 同じ内容を高解像度で描画済みならキャッシュから使う
+        remaining = []
+        for entry in pending:
+            cached = get_cached_render(entry_cache_key(entry, scale=2))
+            if cached is not None:
+                self._store_encoded(session_id, entry, 'final_encoded', cached['encoded'])
+            else:
+                remaining.append(entry)
+        pending = remaining
+        if not pending:
+            return 0
+
+        jobs = [{
+            'template_id': entry['template']['id'],
+            'illustration_id': entry['illustration']['id'] if entry.get('illustration') else None,
+            'render_kwargs': entry_render_kwargs(entry)
+        } for entry in pending]
+
+        failures = 0
+        for completed, outcome in enumerate(iter_render_pipeline(jobs, scale=2), 1):
+            if outcome['error']:
+                failures += 1
+            else:
+                self._store_bytes(session_id, pending[outcome['index']], 'final_encoded', outcome['result']['image'])
+            if on_progress:
+                on_progress(completed, len(pending))
+        return failures
+
+    def _store_bytes(self, session_id, entry, key, image):
+        """画像をエンコードして結果と描画結果のキャッシュに保存し、上限を適用"""
+        encoded = encode_image(image, entry['output_format'], **entry.get('encoder_options', {}))
+        scale = 2 if key == 'final_encoded' else entry.get('scale', 2)
+        store_cached_render(entry_cache_key(entry, scale), encoded, entry.get('title_lines'))
+        return self._store_encoded(session_id, entry, key, encoded)
+
+    def _store_encoded(self, session_id, entry, key, encoded):
+        """エンコード済みバイト列を結果に保存し、上限を適用"""
+        with self._lock:
+            entry[key] = encoded
+            self._touch(entry)
+            if session_id in self._sessions:
+                self._sessions.move_to_end(session_id)
+                self._enforce_budgets(session_id, keep=entry)
+        return encoded
+
+    def usage(self):
+        """現在のメモリ使用量を返す（ホストのサイジング用）"""
+        with self._lock:
+            per_session = {session_id: self._session_size(entries) for session_id, entries in self._sessions.items()}
+            return {
+                'sessions': len(per_session),
+                'results': sum(len(entries) for entries in self._sessions.values()),
+                'bytes': sum(per_session.values()),
+                'session_budget': self.session_budget,
+                'global_budget': self.global_budget,
+                'evictions': self.evictions,
+                'per_session': per_session
+            }
+
+def load_template_image(entry, scale=None):
+    """結果の背景テンプレート画像をフレームIDから取得"""
+    if scale is None:
+        scale = entry.get('scale', 2)
+    return get_decoded_frame(entry['template']['id'], scale=scale)
+
+def load_illustration_image(entry, scale=None):
+    """結果のイラスト画像をフレームIDから取得"""
+    if not entry.get('illustration'):
+        return None
+    if scale is None:
+        scale = entry.get('scale', 2)
+    return fetch_frame_image(entry['illustration']['id'], scale=scale)
+
+def entry_render_kwargs(entry):
+    """結果を描き直すための create_image_with_text の引数（同じ改行を使う）"""
+    return {
+        'title': entry['headline_text'],
+        'subtitle': "",
+        'layout_horizontal': entry['use_horizontal'],
+        'title_manual_lines': entry.get('title_lines') or None,
+        'image_type': entry['headline_type']
+    }
+
+def entry_cache_key(entry, scale=None):
+    """結果の描画結果キャッシュのキー（scale省略時は保存時と同じ倍率）"""
+    if scale is None:
+        scale = entry.get('scale', 2)
+    return render_cache_key(
+        entry['template']['id'],
+        entry['illustration']['id'] if entry.get('illustration') else None,
+        entry_render_kwargs(entry),
+        scale,
+        entry['output_format'],
+        entry.get('encoder_options', {})
+    )
+
+def render_entry_image(entry, scale=None):
+    """保存済みの情報から結果画像を再描画（scale省略時は保存時と同じ倍率）"""
+    if scale is None:
+        scale = entry.get('scale', 2)
+
+    template_image = load_template_image(entry, scale)
+    if template_image is None:
+        return None
+
+    # 記録したイラストが取れなければ別のイラストで代用せず失敗にする
+    illustration_image = load_illustration_image(entry, scale)
+    if entry.get('illustration') and illustration_image is None:
+        return None
+
+    result = create_image_with_text(
+        template_image=template_image,
+        illustration_image=illustration_image,
+        illustration_id=entry['illustration']['id'] if entry.get('illustration') else None,
+        template_id=entry['template']['id'],
+        scale=scale,
+        **entry_render_kwargs(entry)
+    )
+    if not result or not result.get('image'):
+        return None
+    return result['image']
+
+def headline_hash(entry):
+    """見出しの文字と種類のハッシュ（再生成時の対応付け用）"""
+    return hashlib.sha1(f"{entry['headline_type']}\0{entry['headline_text']}".encode('utf-8')).hexdigest()
+
+def match_previous_results(wanted, previous, match_assets=False):
+    """新しい見出しごとに、作り直さずに使える前回の結果を対応付ける
+
+    wanted は新しい見出しごとの結果の下書き（REUSE_FIELDS の各項目を持つ辞書）。
+    まず同じ位置の結果を、なければ見出しのハッシュが同じ別の位置の結果を使う。
+    match_assets=True の場合は背景・イラストも同じ結果に限る。
+    戻り値は wanted と同じ長さのリスト（None は描画が必要な見出し）。
+    """
+    def reusable(entry, want):
+        if any(entry.get(field) != want.get(field) for field in REUSE_FIELDS):
+            return False
+        if match_assets:
+            for key in ('template', 'illustration'):
+                if (entry.get(key) or {}).get('id') != (want.get(key) or {}).get('id'):
+                    return False
+        return True
+
+    matches = [None] * len(wanted)
+    used = set()
+
+    # 同じ位置で内容が変わっていないもの
+    for i, want in enumerate(wanted):
+        if i < len(previous) and reusable(previous[i], want):
+            matches[i] = previous[i]
+            used.add(i)
+
+    # 挿入・削除で位置がずれたもの
+    by_hash = {}
+    for j, entry in enumerate(previous):
+        if j not in used:
+            by_hash.setdefault(headline_hash(entry), []).append(j)
+    for i, want in enumerate(wanted):
+        if matches[i] is not None:
+            continue
+        for j in by_hash.get(headline_hash(want), []):
+            if j not in used and reusable(previous[j], want):
+                matches[i] = previous[j]
+                used.add(j)
+                break
+
+    return matches
+
+# プロセス全体で共有するストア（全セッション共通）
+result_store = ResultStore()
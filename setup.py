@@ -8,7 +8,7 @@ import sys
 
 def create_directories():
     """必要なディレクトリを作成"""
-    directories = ['img', 'templates', 'fonts']
+    directories = ['img', 'templates', 'illustrations', 'fonts']
     
     for dir_name in directories:
         if not os.path.exists(dir_name):
@@ -61,7 +61,7 @@ def main():
     print()
     print("次のステップ:")
     print("1. pip install -r requirements.txt")
-    print("2. templates/ フォルダにテンプレート画像を配置")
+    print("2. templates/ フォルダにテンプレート画像、illustrations/ フォルダにイラストを配置")
     print("3. fonts/ フォルダにフォントファイルを配置")
     print("4. .env ファイルにFigma API情報を設定")
     print("5. streamlit run app.py でアプリを起動")